@@ -1,13 +1,15 @@
 import os
+import threading
 import cv2
 import torch
 import numpy as np
 from flask import Flask, render_template, request
 from werkzeug.utils import secure_filename
 from PIL import Image
-from transformers import pipeline
+from transformers import CLIPModel, CLIPProcessor
 from diffusers import StableDiffusionInpaintPipeline
-from torchvision import models, transforms
+from model_export import (CLIP_MODEL_NAME, ClipImageEncoder, SegmentationLogits, build_segmentation_model,
+                          clip_text_features, load_model, segmentation_preprocess)
 
 app = Flask(__name__)
 
@@ -15,25 +17,69 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads/'
 app.config['OUTPUT_FOLDER'] = 'static/outputs/'
 
-# Load classification model (Places365 for scene detection)
-classifier = pipeline("image-classification", model="openai/clip-vit-base-patch32")
+# Room types used for zero-shot classification; these match Project.room_type values.
+# Override without code changes with e.g. ROOM_TYPES="Bedroom,Kitchen,Nursery"
+DEFAULT_ROOM_TYPES = ["Living Room", "Bedroom", "Kitchen", "Bathroom", "Dining Room", "Office"]
+ROOM_TYPES = [label.strip() for label in os.environ.get("ROOM_TYPES", "").split(",") if label.strip()] \
+    or DEFAULT_ROOM_TYPES
+ROOM_PROMPT_TEMPLATE = os.environ.get("ROOM_PROMPT_TEMPLATE", "a photo of a {}")
+
+# Inpainting prompts per room type (lower-cased); other room types get the generic prompt
+ROOM_PROMPTS = {
+    "bedroom": "enhance bedroom with modern furniture, soft lighting, and minimalistic decor",
+    "living room": "enhance living room with modern furniture, warm lighting, and minimalistic design",
+}
+
+# Tiled full-resolution mode: tile edge in pixels and overlap blended between neighbouring tiles
+TILE_SIZE = 512
+TILE_OVERLAP = 64
+
+# Inference backend for segmentation and CLIP image encoding: eager, compile, torchscript or onnx.
+# The fast profile swaps DeepLabV3-ResNet101 for DeepLabV3-MobileNetV3.
+AI_BACKEND = os.environ.get("AI_BACKEND", "eager")
+AI_PROFILE = os.environ.get("AI_PROFILE", "quality")
+AI_QUANTIZED = os.environ.get("AI_QUANTIZED") == "1"
 
-# Load inpainting model
 device = "cuda" if torch.cuda.is_available() else "cpu"
-pipe_inpaint = StableDiffusionInpaintPipeline.from_pretrained("stabilityai/stable-diffusion-2-inpainting")
-pipe_inpaint = pipe_inpaint.to(device)
 
-# Load the DeepLabV3 segmentation model
-segmentation_model = models.segmentation.deeplabv3_resnet101(pretrained=True)
-segmentation_model.eval().to(device)
+# Models load on first use, so a process only pays for the ones it runs: with AI_WORKERS
+# the web process keeps CLIP and leaves segmentation and inpainting to the workers
+_models = {}
+_models_lock = threading.Lock()
+
+def _model(name, load):
+    with _models_lock:
+        if name not in _models:
+            _models[name] = load()
+        return _models[name]
+
+# Stable Diffusion 2 inpainting pipeline
+def inpaint_pipeline():
+    return _model("inpaint", lambda: StableDiffusionInpaintPipeline.from_pretrained(
+        "stabilityai/stable-diffusion-2-inpainting").to(device))
+
+# DeepLabV3 segmentation model (returns the logits tensor), always fp32: AI_QUANTIZED only applies to CLIP
+def segmentation_model():
+    return _model("segmentation", lambda: load_model(
+        f"segmentation-{AI_PROFILE}", AI_BACKEND, False,
+        lambda: SegmentationLogits(build_segmentation_model(AI_PROFILE)).to(device), device))
+
+# CLIP for room classification and image embeddings (used by the similar designs index):
+# (model, processor, image encoder on the selected backend)
+def clip_models():
+    def load():
+        clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).to(device).eval()
+        clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+        clip_image_encoder = load_model("clip-image", AI_BACKEND, AI_QUANTIZED,
+                                        lambda: ClipImageEncoder(clip_model), device)
+        return clip_model, clip_processor, clip_image_encoder
+    return _model("clip", load)
+
+# Normalised text embeddings per label set, so the text encoder runs once per set
+_label_embeddings = {}
 
 # Define image transformations for segmentation
-preprocess = transforms.Compose([
-    transforms.ToPILImage(),
-    transforms.Resize((512, 512)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
+preprocess = segmentation_preprocess
 
 # Route for uploading an image
 
@@ -42,19 +88,47 @@ preprocess = transforms.Compose([
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'png', 'jpg', 'jpeg'}
 
-# Scene classification function to detect room type
-def classify_room(image_path):
-    result = classifier(image_path)[0]
-    return result['label']
+# Encode the room type prompts once and reuse them for every classification
+def room_label_embeddings(labels=None):
+    labels = tuple(labels or ROOM_TYPES)
+    if labels not in _label_embeddings:
+        clip_model, clip_processor, _ = clip_models()
+        prompts = [ROOM_PROMPT_TEMPLATE.format(label.lower()) for label in labels]
+        inputs = clip_processor(text=prompts, return_tensors="pt", padding=True).to(device)
+        with torch.no_grad():
+            features = clip_text_features(clip_model, inputs)
+        features = features / features.norm(dim=-1, keepdim=True)
+        _label_embeddings[labels] = features.cpu().numpy().astype(np.float32)
+    return _label_embeddings[labels]
+
+# Zero-shot scene classification: one image encoder pass plus a matrix multiply
+def classify_room(image_path, labels=None):
+    labels = labels or ROOM_TYPES
+    image_features = embed_image(image_path).astype(np.float32)
+    scores = room_label_embeddings(labels) @ image_features
+    return labels[int(scores.argmax())]
+
+# Compute L2-normalised CLIP embeddings for a batch of images in one forward pass
+def embed_images(image_paths):
+    _, clip_processor, clip_image_encoder = clip_models()
+    images = [Image.open(path).convert("RGB") for path in image_paths]
+    inputs = clip_processor(images=images, return_tensors="pt").to(device)
+
+    with torch.no_grad():
+        features = clip_image_encoder(inputs["pixel_values"])
+
+    return features.cpu().numpy().astype(np.float16)
+
+def embed_image(image_path):
+    return embed_images([image_path])[0]
 
-# Segment the image and create a prompt based on the room type
 # Segment the image and create a prompt based on the room type
 def segment_and_generate_prompt(image, room_type):
     # Transform the image for segmentation
     input_tensor = preprocess(image).unsqueeze(0).to(device)
 
     with torch.no_grad():
-        output = segmentation_model(input_tensor)['out'][0]
+        output = segmentation_model()(input_tensor)[0]
     
     output_predictions = output.argmax(0).cpu().numpy()
 
@@ -74,30 +148,113 @@ def segment_and_generate_prompt(image, room_type):
     mask_image = Image.fromarray((mask * 255).astype(np.uint8))
 
     # Prompt based on room type
-    if "bedroom" in room_type:
-        prompt = "enhance bedroom with modern furniture, soft lighting, and minimalistic decor"
-    elif "living room" in room_type:
-        prompt = "enhance living room with modern furniture, warm lighting, and minimalistic design"
-    else:
-        prompt = "enhance room with modern furniture and soft lighting"
+    prompt = ROOM_PROMPTS.get(room_type.lower(), "enhance room with modern furniture and soft lighting")
 
     return mask_image, prompt
 
 
-# Function to apply inpainting to the room for enhancements
-def inpaint_room(image, mask, prompt, filename):
+# Run the inpainting model and return the redesigned room as a PIL image
+def redesign_image(image, mask, prompt, num_inference_steps=50):
     # Convert OpenCV image to PIL format
     image_pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
 
     # Generate redesigned room with inpainting
-    result = pipe_inpaint(prompt=prompt, image=image_pil, mask_image=mask, num_inference_steps=50).images[0]
+    return inpaint_pipeline()(prompt=prompt, image=image_pil, mask_image=mask,
+                              num_inference_steps=num_inference_steps).images[0]
 
-    # Save the redesigned image
+# Save a redesigned image to the outputs folder and return its filename
+def save_redesign(result, filename):
     output_filename = f"redesigned_{filename}"
     output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
     result.save(output_path)
-
     return output_filename
 
+# Top-left offsets of overlapping tiles covering a side: the fewest tiles that share at
+# least `overlap` pixels with each neighbour, spread evenly so none sits on top of another
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    count = -(-(length - overlap) // (tile_size - overlap))
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+# Redesign a full-resolution BGR image: segment at low resolution, then inpaint only the
+# tiles that contain furniture so memory stays bounded by the tile size, not the photo size.
+# Returns the redesigned BGR image, the prompt and how many tiles were inpainted.
+def redesign_tiled(image, room_type, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, num_inference_steps=50):
+    height, width = image.shape[:2]
+
+    # Photos smaller than a tile are padded up to one and cropped back at the end
+    pad_y, pad_x = max(0, tile_size - height), max(0, tile_size - width)
+    if pad_y or pad_x:
+        image = cv2.copyMakeBorder(image, 0, pad_y, 0, pad_x, cv2.BORDER_REFLECT)
+    full_height, full_width = image.shape[:2]
+
+    mask_low, prompt = segment_and_generate_prompt(cv2.resize(image, (512, 512)), room_type)
+    mask = cv2.resize(np.asarray(mask_low), (full_width, full_height), interpolation=cv2.INTER_NEAREST)
+    # Pixels already redesigned by an earlier tile; later tiles keep them as known context
+    done = np.zeros(mask.shape, dtype=bool)
+    grow = max(1, overlap // 8)
+    kernel = np.ones((2 * grow + 1, 2 * grow + 1), np.uint8)
+
+    output = image.copy()
+    inpainted = 0
+    for y in _tile_starts(full_height, tile_size, overlap):
+        for x in _tile_starts(full_width, tile_size, overlap):
+            region = (slice(y, y + tile_size), slice(x, x + tile_size))
+            tile_mask = np.where(done[region], 0, mask[region]).astype(np.uint8)
+            if not tile_mask.any():
+                continue
+
+            # Inpaint from the current output, so furniture an earlier tile drew in the overlap is
+            # unmasked context the model continues rather than something it redraws from noise
+            tile = output[region]
+            result = redesign_image(tile, Image.fromarray(tile_mask), prompt, num_inference_steps)
+            if result.size != (tile_size, tile_size):
+                result = result.resize((tile_size, tile_size))
+            result = cv2.cvtColor(np.asarray(result), cv2.COLOR_RGB2BGR).astype(np.float32)
+
+            # Take the result fully inside this tile's mask and fade it out just past the mask, so
+            # the seam with earlier tiles and the untouched room is not a hard line
+            soft_mask = np.maximum(tile_mask, cv2.GaussianBlur(cv2.dilate(tile_mask, kernel), (0, 0), grow))
+            alpha = (soft_mask.astype(np.float32) / 255)[..., None]
+            tile[...] = np.rint(alpha * result + (1 - alpha) * tile).astype(np.uint8)
+            done[region] |= tile_mask > 0
+            inpainted += 1
+
+    return output[:height, :width], prompt, inpainted
+
+# Preprocess the photo and mask and VAE-encode the masked photo once, so trying other
+# styles on the same room only reruns the denoising loop (see redesign_sessions.py)
+def encode_redesign_inputs(image, mask):
+    image_pil = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    pipe_inpaint = inpaint_pipeline()
+    dtype = pipe_inpaint.vae.dtype
+
+    with torch.no_grad():
+        image_tensor = pipe_inpaint.image_processor.preprocess(image_pil).to(device, dtype=dtype)
+        mask_tensor = pipe_inpaint.mask_processor.preprocess(mask).to(device, dtype=dtype)
+        masked_image = image_tensor * (mask_tensor < 0.5)
+        latents = pipe_inpaint.vae.encode(masked_image).latent_dist.mode()
+
+    return image_pil, latents * pipe_inpaint.vae.config.scaling_factor
+
+# Text embeddings for a style prompt: (prompt_embeds, negative_prompt_embeds)
+def encode_style_prompt(prompt):
+    with torch.no_grad():
+        return inpaint_pipeline().encode_prompt(prompt, device, num_images_per_prompt=1,
+                                                do_classifier_free_guidance=True)
+
+# Denoise from cached inputs; several variations share one batched call
+def redesign_from_cache(image_pil, mask, masked_image_latents, prompt_embeds, negative_prompt_embeds,
+                        num_images=1, num_inference_steps=50):
+    return inpaint_pipeline()(prompt_embeds=prompt_embeds, negative_prompt_embeds=negative_prompt_embeds,
+                              image=image_pil, mask_image=mask, masked_image_latents=masked_image_latents,
+                              num_images_per_prompt=num_images, num_inference_steps=num_inference_steps).images
+
+# Function to apply inpainting to the room for enhancements
+def inpaint_room(image, mask, prompt, filename):
+    result = redesign_image(image, mask, prompt)
+    return save_redesign(result, filename)
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,373 @@
+import atexit
+import contextlib
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+from PIL import Image
+
+# A 512x512 RGB image, the largest array the /ai flow sends through a ring
+DEFAULT_SLOT_BYTES = 512 * 512 * 3
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+
+class SharedImageRing:
+    """Fixed-size slots in one shared memory block, handed out through a queue of free slot numbers.
+
+    Only small ``(slot, shape, dtype)`` descriptors travel over the control
+    queues; the pixels are written once into shared memory and read in place.
+    """
+
+    def __init__(self, slots, slot_bytes, ctx):
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free = ctx.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+    def view(self, descriptor):
+        slot, shape, dtype = descriptor
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def write(self, slot, array):
+        """Copy an array into a slot the caller already holds and return its descriptor."""
+        array = np.ascontiguousarray(array)
+        if array.nbytes > self.slot_bytes:
+            raise ValueError(f"array of {array.nbytes} bytes does not fit a {self.slot_bytes} byte slot")
+        descriptor = (slot, array.shape, array.dtype.str)
+        self.view(descriptor)[...] = array
+        return descriptor
+
+    def put(self, array):
+        """Copy an array into a free slot (blocking until one is available) and return its descriptor."""
+        slot = self.free.get()
+        try:
+            return self.write(slot, array)
+        except Exception:
+            self.free.put(slot)
+            raise
+
+    def release(self, descriptor):
+        self.free.put(descriptor[0])
+
+    def take(self, descriptor):
+        """Copy an array out of its slot and give the slot back."""
+        array = np.array(self.view(descriptor))
+        self.release(descriptor)
+        return array
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+@contextlib.contextmanager
+def _worker_launch(threads):
+    """Environment for starting a worker process.
+
+    The thread limits must be in the environment before the child imports
+    numpy or torch, so they are set in the parent around ``start()``. Spawn
+    would also re-run the web app's ``__main__`` script in every worker
+    (loading all models and building the Flask app again); hiding it makes
+    the workers import only this module and ai.py.
+    """
+    saved_env = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    main = sys.modules['__main__']
+    saved_main = {attr: main.__dict__[attr] for attr in ('__file__', '__spec__') if attr in main.__dict__}
+    main.__dict__.pop('__file__', None)
+    main.__spec__ = None
+    os.environ.update({var: str(threads) for var in THREAD_ENV_VARS})
+    try:
+        yield
+    finally:
+        main.__dict__.update(saved_main)
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def _pin_threads(threads):
+    # Each worker gets its own share of the cores so N workers don't oversubscribe them
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    cv2.setNumThreads(threads)
+
+
+def _run_job(ai, kind, images, options):
+    """Run one job on arrays that live in shared memory; returns (output array, extra result)."""
+    if kind == 'segment':
+        mask, prompt = ai.segment_and_generate_prompt(images[0], options['room_type'])
+        return np.asarray(mask), prompt
+
+    if kind == 'inpaint':
+        result = ai.redesign_image(images[0], Image.fromarray(images[1]), options['prompt'],
+                                   num_inference_steps=options.get('num_inference_steps', 50))
+        return np.asarray(result), None
+
+    if kind == 'redesign':
+        mask, prompt = ai.segment_and_generate_prompt(images[0], options['room_type'])
+        result = ai.redesign_image(images[0], mask, prompt,
+                                   num_inference_steps=options.get('num_inference_steps', 50))
+        return np.asarray(result), prompt
+
+    raise ValueError(f"unknown job kind: {kind}")
+
+
+def _worker_main(tasks, results, inputs, outputs, threads):
+    _pin_threads(threads)
+    import ai
+
+    # Load the models the jobs use now rather than on the first job
+    ai.segmentation_model()
+    ai.inpaint_pipeline()
+    results.send(None)
+
+    # The parent hands out and takes back every slot, so a worker that dies leaks nothing
+    while True:
+        task = tasks.recv()
+        if task is None:
+            break
+
+        job_id, kind, descriptors, output_slot, options = task
+        images = [inputs.view(descriptor) for descriptor in descriptors]
+        try:
+            array, extra = _run_job(ai, kind, images, options)
+            results.send((job_id, outputs.write(output_slot, array), extra, None))
+        except Exception:
+            results.send((job_id, None, None, traceback.format_exc()))
+        finally:
+            del images
+
+    inputs.close()
+    outputs.close()
+
+
+class WorkerDied(RuntimeError):
+    """A model worker process exited while running a job (e.g. killed for running out of memory)."""
+
+
+class AIWorkerPool:
+    """Model worker processes that exchange images with the web process through shared memory.
+
+    Each worker loads the ai.py models once and has its own task and result
+    pipes. The caller writes input arrays into the ``inputs`` ring and
+    reserves an ``outputs`` slot per job; the worker writes its result there.
+    A collector thread copies results out, resolves futures and watches the
+    worker processes: jobs of a worker that dies fail with ``WorkerDied``,
+    their slots are returned and the worker is replaced. A worker that dies
+    before its models have loaded is not replaced, since its replacement
+    would most likely fail the same way.
+    """
+
+    def __init__(self, workers=2, threads_per_worker=None, slots=None, slot_bytes=DEFAULT_SLOT_BYTES):
+        self._ctx = mp.get_context('spawn')
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        slots = slots or workers * 2
+
+        # inpaint jobs carry two inputs (image and mask), results are always one array
+        self.inputs = SharedImageRing(slots * 2, slot_bytes, self._ctx)
+        self.outputs = SharedImageRing(slots, slot_bytes, self._ctx)
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._workers = [self._start_worker() for _ in range(workers)]
+        self._ready = [False] * workers
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        atexit.register(self.close)
+
+    def _start_worker(self):
+        task_reader, task_writer = self._ctx.Pipe(duplex=False)
+        result_reader, result_writer = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(target=_worker_main, daemon=True,
+                                    args=(task_reader, result_writer, self.inputs, self.outputs,
+                                          self.threads_per_worker))
+        with _worker_launch(self.threads_per_worker):
+            process.start()
+        task_reader.close()
+        result_writer.close()
+        # Connections aren't thread-safe, so sends from request threads share a lock per worker
+        return (process, task_writer, result_reader, threading.Lock())
+
+    def _finish(self, job_id):
+        """Take a job out of the table and give back its slots; None if it was already finished."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return None
+        future, _, descriptors, output_slot = job
+        for descriptor in descriptors:
+            self.inputs.release(descriptor)
+        self.outputs.free.put(output_slot)
+        return future
+
+    def _handle_message(self, index, message):
+        if message is None:
+            # Sent once the worker's models have loaded
+            self._ready[index] = True
+        else:
+            self._handle_result(message)
+
+    def _handle_result(self, message):
+        job_id, descriptor, extra, error = message
+        array = np.array(self.outputs.view(descriptor)) if descriptor else None
+        future = self._finish(job_id)
+        if future is None:
+            return
+        if error:
+            future.set_exception(RuntimeError(f"AI worker job failed:\n{error}"))
+        else:
+            future.set_result(([array], extra))
+
+    def _handle_exit(self, index):
+        worker = self._workers[index]
+        process, task_writer, result_reader, _ = worker
+        process.join()
+        # Results it sent before exiting are still valid
+        try:
+            while result_reader.poll():
+                self._handle_message(index, result_reader.recv())
+        except (EOFError, OSError):
+            pass
+
+        replacement = None
+        if self._ready[index]:
+            replacement = self._start_worker()
+        else:
+            print(f"AI worker {index} exited with code {process.exitcode} while loading models; not restarting it")
+
+        # Swap in the replacement before closing the old pipes, so new jobs never pick a dead worker
+        with self._lock:
+            self._workers[index] = replacement
+            self._ready[index] = False
+            lost = [job_id for job_id, job in self._jobs.items() if job[1] is worker]
+        result_reader.close()
+        task_writer.close()
+
+        for job_id in lost:
+            future = self._finish(job_id)
+            if future is not None:
+                future.set_exception(WorkerDied(f"AI worker {index} exited with code {process.exitcode}"))
+
+    def _collect(self):
+        while not self._closed:
+            workers = [(index, worker) for index, worker in enumerate(self._workers) if worker is not None]
+            readers = {result_reader: index for index, (_, _, result_reader, _) in workers}
+            sentinels = {process.sentinel: index for index, (process, _, _, _) in workers}
+            # Wake up now and then so a close() is noticed
+            for ready in wait(list(readers) + list(sentinels), timeout=1.0):
+                if ready in readers:
+                    try:
+                        self._handle_message(readers[ready], ready.recv())
+                    except (EOFError, OSError):
+                        pass  # the worker is gone; its sentinel handles the rest
+                elif not self._closed:
+                    self._handle_exit(sentinels[ready])
+
+    def _dispatch(self, job_id, future, descriptors, output_slot):
+        """Assign a job to the running worker with the fewest jobs in flight; returns that worker."""
+        with self._lock:
+            busy = {id(worker): [0, worker] for worker in self._workers if worker is not None}
+            if not busy:
+                return None
+            for job in self._jobs.values():
+                if id(job[1]) in busy:
+                    busy[id(job[1])][0] += 1
+            worker = min(busy.values(), key=lambda entry: entry[0])[1]
+            self._jobs[job_id] = (future, worker, descriptors, output_slot)
+            return worker
+
+    def submit(self, kind, images, **options):
+        """Queue a job and return a Future of ``([output array], extra result)``."""
+        if self._closed:
+            raise RuntimeError("AI worker pool is closed")
+        descriptors = [self.inputs.put(image) for image in images]
+        output_slot = self.outputs.free.get()
+        future = Future()
+        job_id = next(self._job_ids)
+
+        while True:
+            worker = self._dispatch(job_id, future, descriptors, output_slot)
+            if worker is None:
+                for descriptor in descriptors:
+                    self.inputs.release(descriptor)
+                self.outputs.free.put(output_slot)
+                raise RuntimeError("no AI workers are running")
+            _, task_writer, _, send_lock = worker
+            try:
+                with send_lock:
+                    task_writer.send((job_id, kind, descriptors, output_slot, options))
+                return future
+            except (OSError, ValueError):
+                # That worker died; wait for the collector to replace it and pick again
+                with self._lock:
+                    if self._jobs.pop(job_id, None) is None:
+                        return future  # already failed by the collector
+                time.sleep(0.05)
+
+    def segment(self, image, room_type):
+        arrays, prompt = self.submit('segment', [image], room_type=room_type).result()
+        return Image.fromarray(arrays[0]), prompt
+
+    def inpaint(self, image, mask, prompt, num_inference_steps=50):
+        arrays, _ = self.submit('inpaint', [image, np.asarray(mask)], prompt=prompt,
+                                num_inference_steps=num_inference_steps).result()
+        return Image.fromarray(arrays[0])
+
+    def redesign(self, image, room_type, num_inference_steps=50):
+        """Segment and inpaint in a single job; returns (redesigned PIL image, prompt)."""
+        arrays, prompt = self.submit('redesign', [image], room_type=room_type,
+                                     num_inference_steps=num_inference_steps).result()
+        return Image.fromarray(arrays[0]), prompt
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._collector.join()
+
+        for index, worker in enumerate(self._workers):
+            if worker is None:
+                continue
+            process, task_writer, result_reader, send_lock = worker
+            with send_lock:
+                try:
+                    task_writer.send(None)
+                except OSError:
+                    pass
+            process.join()
+            # Drain results so their futures resolve, then fail whatever never finished
+            try:
+                while result_reader.poll():
+                    self._handle_message(index, result_reader.recv())
+            except (EOFError, OSError):
+                pass
+        with self._lock:
+            pending = list(self._jobs)
+        for job_id in pending:
+            future = self._finish(job_id)
+            if future is not None:
+                future.set_exception(RuntimeError("AI worker pool closed"))
+
+        for ring in (self.inputs, self.outputs):
+            ring.close()
+            ring.unlink()
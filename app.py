@@ -1,15 +1,25 @@
 import random
 import sys
+import threading
+import uuid
+import click
 import cv2
 from flask import Flask, jsonify, render_template, redirect, url_for, request, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.utils import secure_filename
 from flask_migrate import Migrate
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from ai import classify_room, inpaint_room, segment_and_generate_prompt
-from db_setup import db, User, Project, Review, ChatRoom, Message
+from ai import classify_room, embed_image, embed_images, redesign_tiled, save_redesign
+from ai_workers import AIWorkerPool
+from db_setup import db, User, Project, Review, ChatRoom, Message, rebuild_review_aggregates
+from assets import build_assets, init_assets
+from chat_broadcast import RoomBroadcaster, RoomPresence
+from chat_sync import MAX_RESYNC_MESSAGES, RecentMessages
+from embeddings import EmbeddingIndex
+from redesign_sessions import MAX_VARIATIONS, RedesignSessionStore
 import os
 from datetime import datetime
+from PIL import Image
 
 app = Flask(__name__)
 
@@ -24,15 +34,54 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# Fingerprinted CSS bundles, response compression and the Jinja bytecode cache
+init_assets(app)
+
 # Ensure the upload folder exists
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
 ALLOWED_EXTENSIONS = {'jpg', 'jpeg'}
 
+# CLIP embeddings of project images, used for "similar designs"
+project_index = EmbeddingIndex()
+
+# Photos, masks, latents and prompt embeddings of recent redesigns, for "try another style"
+redesign_sessions = RedesignSessionStore()
+
+# Who is connected to which chat room, and per-room batching of outbound events
+# (CHAT_MSGPACK=1 sends batches as msgpack instead of JSON)
+presence = RoomPresence()
+broadcaster = RoomBroadcaster(socketio, presence, use_msgpack=os.environ.get('CHAT_MSGPACK') == '1')
+
+# Optional pool of model worker processes (AI_WORKERS=N), started on the first /ai request
+ai_pool = None
+# Concurrent first requests must not each start a pool of workers loading the models
+ai_pool_lock = threading.Lock()
+
+def get_ai_pool():
+    global ai_pool
+    with ai_pool_lock:
+        if ai_pool is None and int(os.environ.get('AI_WORKERS', 0)) > 0:
+            ai_pool = AIWorkerPool(workers=int(os.environ['AI_WORKERS']),
+                                   threads_per_worker=int(os.environ.get('AI_WORKER_THREADS', 0)) or None)
+        return ai_pool
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def project_image_file(project):
+    return os.path.join('static', project.image_path)
+
+def find_similar_projects(vector, limit=6, exclude=()):
+    """Return the projects whose images are closest to the given embedding, best match first."""
+    matches = project_index.search(vector, k=limit, exclude=exclude)
+    if not matches:
+        return []
+    found = Project.query.filter(Project.id.in_([project_id for project_id, _ in matches])).all()
+    by_id = {project.id: project for project in found}
+    return [by_id[project_id] for project_id, _ in matches if project_id in by_id]
+
 @app.route('/ai', methods=['GET', 'POST'])
 def upload_image():
     if request.method == 'POST':
@@ -42,24 +91,60 @@ def upload_image():
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(file_path)
 
+            # Show existing projects that look like the uploaded room instead of redesigning it
+            if request.form.get('action') == 'similar':
+                projects = find_similar_projects(embed_image(file_path), limit=10)
+                return render_template('design_home.html', projects=projects,
+                                       project_ids=[p.id for p in projects])
+
             # Process the uploaded image
             image = cv2.imread(file_path)
 
-            # Resize the image for processing
-            image_resized = cv2.resize(image, (512, 512))  # Resizing for processing efficiency
-
             # Classify room type
             room_type = classify_room(file_path)
 
-            # Segment the image and apply enhancements
-            mask, prompt = segment_and_generate_prompt(image_resized, room_type)
+            if request.form.get('full_resolution'):
+                # Keep the photo's size and aspect ratio; only tiles containing furniture are inpainted
+                result, prompt, _ = redesign_tiled(image, room_type)
+                result = Image.fromarray(cv2.cvtColor(result, cv2.COLOR_BGR2RGB))
+                return render_template('upload.html', filename=save_redesign(result, filename))
 
-            # Inpaint the image using the prompt
-            redesigned_image_path = inpaint_room(image_resized, mask, prompt, filename)
+            # Resize the image for processing
+            image_resized = cv2.resize(image, (512, 512))  # Resizing for processing efficiency
+
+            pool = get_ai_pool()
+            if pool:
+                # Segment and inpaint in a worker process; images travel through shared memory
+                result, prompt = pool.redesign(image_resized, room_type)
+                redesigned_image_path = save_redesign(result, filename)
+            else:
+                # Segment and encode the photo once; later styles reuse it through the session
+                redesign = redesign_sessions.create(image_resized, room_type, filename)
+                session['redesign_id'] = redesign.id
+                redesigned_image_path = save_redesign(redesign.render()[0], filename)
+                return render_template('upload.html', filename=redesigned_image_path,
+                                       redesign=redesign, max_variations=MAX_VARIATIONS)
 
             return render_template('upload.html', filename=redesigned_image_path)
     return render_template('result.html')
 
+@app.route('/ai/restyle', methods=['POST'])
+def restyle_redesign():
+    """Try another style on the last uploaded photo, reusing its cached mask and latents."""
+    redesign = redesign_sessions.get(session.get('redesign_id'))
+    if redesign is None:
+        flash('Your redesign session has expired, please upload the photo again.', 'warning')
+        return redirect(url_for('upload_image'))
+
+    style = request.form.get('style', '').strip() or redesign.prompt
+    variations = min(max(request.form.get('variations', 1, type=int), 1), MAX_VARIATIONS)
+
+    # All variations come out of one batched denoising call
+    images = redesign.render(style, num_variations=variations)
+    filenames = [save_redesign(image, f"{uuid.uuid4().hex[:8]}_{redesign.filename}") for image in images]
+    return render_template('upload.html', filenames=filenames, redesign=redesign,
+                           style=style, max_variations=MAX_VARIATIONS)
+
 @app.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -85,17 +170,25 @@ def design_your_home():
     # Get room filter values from the form (if any)
     selected_rooms = request.form.getlist('rooms')  # List of selected room types from the checkbox
     
+    sort = request.form.get('sort')
+
     # Query all projects, filter by selected room types if provided
+    query = Project.query
     if selected_rooms:
-        projects = Project.query.filter(Project.room_type.in_(selected_rooms)).all()
+        query = query.filter(Project.room_type.in_(selected_rooms))
+
+    if sort == 'top_rated':
+        # Walks the rating_avg index instead of aggregating the reviews table
+        random_projects = query.filter(Project.rating_avg.isnot(None)) \
+            .order_by(Project.rating_avg.desc(), Project.rating_count.desc()).limit(10).all()
     else:
-        projects = Project.query.all()
+        projects = query.all()
 
-    # Get up to 10 random projects (or as many as available)
-    random_projects = random.sample(projects, min(10, len(projects)))  # Fetch random projects
+        # Get up to 10 random projects (or as many as available)
+        random_projects = random.sample(projects, min(10, len(projects)))  # Fetch random projects
     project_ids = [p.id for p in random_projects]  # Get the IDs of the random projects
     
-    return render_template('design_home.html', projects=random_projects, project_ids=project_ids)
+    return render_template('design_home.html', projects=random_projects, project_ids=project_ids, sort=sort)
 
 # Route to log out
 @app.route('/logout')
@@ -151,9 +244,13 @@ def project_details(project_id):
         # Non-uploaders only have access to their specific chat room with the uploader, if it exists
         chats = []
 
+    vector = project_index.get(project_id)
+    similar_projects = find_similar_projects(vector, exclude=[project_id]) if vector is not None else []
+
     # Render the project details template with the correct context
     return render_template('project_details.html', project=project, reviews=reviews, 
-                           current_user_id=current_user_id, chats=chats)
+                           current_user_id=current_user_id, chats=chats,
+                           similar_projects=similar_projects)
 
 @app.route('/submit_review/<int:project_id>', methods=['POST'])
 def submit_review(project_id):
@@ -165,10 +262,14 @@ def submit_review(project_id):
     if not review_content:
         flash('Review cannot be empty', 'warning')
         return redirect(url_for('project_details', project_id=project_id))
-    
-    new_review = Review(content=review_content, project_id=project_id, user_id=session['user_id'])
-    db.session.add(new_review)
-    db.session.commit()
+
+    rating = request.form.get('rating', type=int)
+    if rating is not None and not 1 <= rating <= 5:
+        flash('Rating must be between 1 and 5 stars', 'warning')
+        return redirect(url_for('project_details', project_id=project_id))
+
+    project = Project.query.get_or_404(project_id)
+    Review.add_review(project, session['user_id'], review_content, rating)
 
     flash('Your review has been submitted!', 'success')
     return redirect(url_for('project_details', project_id=project_id))
@@ -210,6 +311,9 @@ def add_product():
             db.session.add(new_project)
             db.session.commit()
 
+            # Index the image once on upload so similarity lookups never re-run CLIP
+            project_index.add(new_project.id, embed_image(file_path))
+
             flash('Project added successfully!', 'success')
             return redirect(url_for('home'))
 
@@ -243,9 +347,10 @@ def chat_with_uploader(project_id):
 
     # Find or create a private chat room based on user_id and uploader_id
     chat_room = ChatRoom.find_or_create_private_room(project_id, user_id, uploader_id)
-    messages = Message.query.filter_by(chat_room_id=chat_room.id).all()
+    messages = Message.query.filter_by(chat_room_id=chat_room.id).order_by(Message.id).all()
 
-    return render_template('chat.html', project=project, chat_room=chat_room, messages=messages, current_user_id=user_id)
+    return render_template('chat.html', project=project, chat_room=chat_room, messages=messages, current_user_id=user_id,
+                           chat_msgpack=broadcaster.use_msgpack)
 
 @app.route('/uploader_chat/<int:project_id>/<int:chat_room_id>', methods=['GET'])
 def uploader_chat(project_id, chat_room_id):
@@ -273,59 +378,146 @@ def uploader_chat(project_id, chat_room_id):
         flash('Chat room not found', 'danger')
         return redirect(url_for('home'))
 
-    messages = Message.query.filter_by(chat_room_id=chat_room.id).all()
-    return render_template('chat.html', project=project, chat_room=chat_room, messages=messages, current_user_id=user_id)
+    messages = Message.query.filter_by(chat_room_id=chat_room.id).order_by(Message.id).all()
+    return render_template('chat.html', project=project, chat_room=chat_room, messages=messages, current_user_id=user_id,
+                           chat_msgpack=broadcaster.use_msgpack)
+
+# Recent messages per room, so reconnecting clients can resync without a database query
+recent_messages = RecentMessages()
+
+def message_payload(message_id, username, content, created_at):
+    """The compact form of a chat message sent to clients."""
+    return {
+        'id': message_id,
+        'username': username,
+        'message': content,
+        'timestamp': created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def chat_room_for(room):
+    """Look up the ChatRoom behind a "<user_id>_<uploader_id>" socket room string."""
+    try:
+        user_id, uploader_id = map(int, room.split("_"))
+    except ValueError as e:
+        print(f"Error parsing room identifier: {e}")
+        return None
+    return ChatRoom.query.filter_by(user_id=user_id, uploader_id=uploader_id).first()
+
+def is_participant(chat_room, user_id):
+    return user_id is not None and user_id in (chat_room.user_id, chat_room.uploader_id)
+
+def messages_after(room, chat_room, last_id):
+    """Payloads of the messages in a room newer than last_id, from memory when possible.
+
+    Returns (payloads, has_more). The database is read MAX_RESYNC_MESSAGES at a
+    time; has_more means the client should ask again after the last payload.
+    """
+    missing = recent_messages.since(room, last_id)
+    if missing is not None:
+        return missing, False
+
+    rows = db.session.query(Message, User.username).join(User, Message.sender_id == User.id) \
+        .filter(Message.chat_room_id == chat_room.id, Message.id > last_id) \
+        .order_by(Message.id).limit(MAX_RESYNC_MESSAGES + 1).all()
+    has_more = len(rows) > MAX_RESYNC_MESSAGES
+    missing = [message_payload(message.id, username, message.content, message.created_at)
+               for message, username in rows[:MAX_RESYNC_MESSAGES]]
+
+    if not has_more:
+        # Everything after last_id is known now; seeding lets the next resync skip the database
+        recent_messages.load(room, missing, last_id)
+    return missing, has_more
+
+def parse_message_id(value):
+    """A client-supplied message id as an int, or None if it isn't one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def send_missed_messages(room, chat_room, last_id):
+    messages, has_more = messages_after(room, chat_room, last_id)
+    emit('sync_messages', {'messages': messages, 'has_more': has_more})
+
+def queue_presence(room):
+    broadcaster.queue(room, 'presence', {'online': sorted(presence.users_in(room))})
+
+@socketio.on('connect')
+def handle_connect():
+    presence.connect(request.sid, session.get('user_id'))
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    for room in presence.disconnect(request.sid):
+        queue_presence(room)
 
 @socketio.on('join')
 def handle_join(data):
     room = data['room']
+    # Only the two people in the chat may listen, mark messages read or show up as present;
+    # the room string alone is easy to guess
+    chat_room = chat_room_for(room)
+    if not chat_room or not is_participant(chat_room, session.get('user_id')):
+        return
+
     join_room(room)
-    emit('status', {'msg': f"{data['username']} has joined the room."}, room=room)
+    presence.join(request.sid, room)
+    broadcaster.queue(room, 'status', {'msg': f"{session['username']} has joined the room."})
+    queue_presence(room)
+
+    # Whoever joins has now seen the room, so messages waiting for them are read
+    Message.mark_messages_as_read(chat_room.id, session['user_id'])
+
+    # A reconnecting client sends the last message id it has; reply with only what it missed
+    last_id = parse_message_id(data.get('last_message_id'))
+    if last_id is not None:
+        send_missed_messages(room, chat_room, last_id)
+
+@socketio.on('sync')
+def handle_sync(data):
+    # The next page of a resync that came back with has_more
+    room = data['room']
+    chat_room = chat_room_for(room)
+    if not chat_room or not is_participant(chat_room, session.get('user_id')):
+        return
+    last_id = parse_message_id(data.get('last_message_id'))
+    if last_id is not None:
+        send_missed_messages(room, chat_room, last_id)
 
 @socketio.on('send_message')
 def handle_send_message(data):
     room = data['room']
-    username = data['username']
     message_content = data['message']
     
     # Debugging output to check room format and data
     print(f"Room identifier: {room}")
-    print(f"Sender username: {username}")
     print(f"Message content: {message_content}")
     
-    # Parse user_id and uploader_id from room string
-    try:
-        user_id, uploader_id = map(int, room.split("_"))
-    except ValueError as e:
-        print(f"Error parsing room identifier: {e}")
-        return
-    
-    # Retrieve sender (User) and chat room (ChatRoom) from the database
-    sender = User.query.filter_by(username=username).first()
-    chat_room = ChatRoom.query.filter_by(user_id=user_id, uploader_id=uploader_id).first()
+    # The sender is whoever is signed in on this socket, and only the chat's two participants may post
+    sender = User.query.get(session['user_id']) if 'user_id' in session else None
+    chat_room = chat_room_for(room)
     
     # Debugging output to confirm fetched data
     print(f"Sender: {sender}")
     print(f"Chat Room: {chat_room}")
 
-    if sender and chat_room:
-        # Create and save new message to database
+    if sender and chat_room and is_participant(chat_room, sender.id):
+        # Create and save new message to database; it is read already if the other participant is in the room
         new_message = Message(
             content=message_content,
             chat_room_id=chat_room.id,
             sender_id=sender.id,
-            created_at=datetime.utcnow()
+            created_at=datetime.utcnow(),
+            read=bool(presence.users_in(room) - {sender.id})
         )
         
         db.session.add(new_message)
         db.session.commit()
         
-        # Emit the message to everyone in the room
-        emit('receive_message', {
-            'username': username,
-            'message': message_content,
-            'timestamp': new_message.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        }, room=room)
+        # Send the message to everyone in the room with the next batch; the id lets clients drop duplicates
+        payload = message_payload(new_message.id, sender.username, message_content, new_message.created_at)
+        recent_messages.append(room, payload)
+        broadcaster.queue(room, 'receive_message', payload)
     else:
         print("Error: Invalid sender or chat room.")
 
@@ -356,6 +548,7 @@ def delete_project(project_id):
     if project.user_id == user.id:
         db.session.delete(project)
         db.session.commit()
+        project_index.remove(project_id)
         flash('Project deleted successfully!', 'success')
     else:
         flash('You can only delete your own projects.', 'danger')
@@ -375,6 +568,34 @@ def view_uploader_profile(user_id):
     # Pass the user and their projects to the template
     return render_template('profile.html', user=user, projects=projects)
 
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minify, fingerprint and precompress the stylesheets into static/dist."""
+    for source, built in build_assets().items():
+        click.echo(f"{source} -> {built}")
+
+@app.cli.command('rebuild-review-aggregates')
+@click.option('--batch-size', default=500, help='Projects or users updated per transaction.')
+def rebuild_review_aggregates_command(batch_size):
+    """Recompute cached review counts and ratings from the reviews table."""
+    rebuild_review_aggregates(batch_size)
+    click.echo('Review aggregates rebuilt')
+
+@app.cli.command('backfill-embeddings')
+@click.option('--batch-size', default=32, help='Images per CLIP forward pass.')
+@click.option('--reindex', is_flag=True, help='Recompute embeddings that already exist.')
+def backfill_embeddings(batch_size, reindex):
+    """Compute CLIP embeddings for project images missing from the similarity index."""
+    projects = Project.query.filter(Project.image_path.isnot(None)).order_by(Project.id).all()
+    pending = [p for p in projects if (reindex or p.id not in project_index)
+               and os.path.exists(project_image_file(p))]
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        vectors = embed_images([project_image_file(p) for p in batch])
+        project_index.add_many([p.id for p in batch], vectors)
+        click.echo(f"Indexed {start + len(batch)}/{len(pending)} projects")
+
 if __name__ == '__main__':
     socketio.run(app, host='127.0.0.1', port=5000, debug=True)
 
@@ -0,0 +1,136 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+from jinja2 import FileSystemBytecodeCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+STATIC_FOLDER = 'static'
+ASSET_SOURCES = os.path.join(STATIC_FOLDER, 'css')
+DIST_FOLDER = os.path.join(STATIC_FOLDER, 'dist')
+MANIFEST_PATH = os.path.join(DIST_FOLDER, 'manifest.json')
+
+# Fingerprinted files never change, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json'}
+MIN_COMPRESS_BYTES = 500
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    css = re.sub(r':\s+', ':', css)
+    return css.replace(';}', '}').strip()
+
+
+def _write_compressed(path, data):
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build_assets():
+    """Minify every stylesheet under static/css into fingerprinted, precompressed files in static/dist.
+
+    Returns the manifest mapping source paths (relative to static/) to built paths.
+    """
+    manifest = {}
+    for directory, _, filenames in os.walk(ASSET_SOURCES):
+        for filename in sorted(filenames):
+            if not filename.endswith('.css'):
+                continue
+            source = os.path.join(directory, filename)
+            with open(source, encoding='utf-8') as f:
+                data = minify_css(f.read()).encode('utf-8')
+
+            digest = hashlib.md5(data).hexdigest()[:10]
+            relative = os.path.relpath(source, STATIC_FOLDER).replace(os.sep, '/')
+            built = f"dist/{relative[:-len('.css')]}.{digest}.css"
+            target = os.path.join(STATIC_FOLDER, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            _write_compressed(target, data)
+            manifest[relative] = built
+
+    os.makedirs(DIST_FOLDER, exist_ok=True)
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def _accepted_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def init_assets(app, bytecode_cache_dir=os.path.join('instance', 'jinja_cache')):
+    """Serve built assets, compress responses and cache compiled templates for ``app``."""
+    # Must be set before anything touches app.jinja_env, which is created on first use
+    os.makedirs(bytecode_cache_dir, exist_ok=True)
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(bytecode_cache_dir)}
+    app.config.setdefault('COMPRESS_RESPONSES', True)
+
+    manifest = load_manifest()
+
+    def asset_url(path):
+        """URL of the fingerprinted build of a static file, or the file itself if it hasn't been built."""
+        return url_for('static', filename=manifest.get(path, path))
+
+    app.add_template_global(asset_url)
+
+    @app.route('/static/dist/<path:filename>')
+    def built_asset(filename):
+        encoding = _accepted_encoding()
+        suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding)
+        if suffix and os.path.exists(os.path.join(DIST_FOLDER, filename + suffix)):
+            response = send_from_directory(os.path.abspath(DIST_FOLDER), filename + suffix, max_age=31536000)
+            response.mimetype = 'text/css' if filename.endswith('.css') else response.mimetype
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(os.path.abspath(DIST_FOLDER), filename, max_age=31536000)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @app.after_request
+    def compress_response(response):
+        if (not app.config['COMPRESS_RESPONSES'] or response.direct_passthrough or response.is_streamed
+                or response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        data = response.get_data()
+        encoding = _accepted_encoding()
+        if encoding is None or len(data) < MIN_COMPRESS_BYTES:
+            return response
+
+        if encoding == 'br':
+            # A low brotli quality keeps per-request CPU close to gzip while still compressing better
+            response.set_data(brotli.compress(data, quality=5))
+        else:
+            response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,61 @@
+"""Throughput of the AI worker pool for different worker counts and intra-op thread counts.
+
+Usage: python benchmarks/bench_ai_workers.py [--workers 1,2,4] [--threads 1,2,4]
+                                              [--kind segment] [--jobs 16] [--steps 10]
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from ai_workers import AIWorkerPool  # noqa: E402
+
+IMAGE = os.path.join('static', 'uploads', 'pic_5.jpg')
+
+
+def submit(pool, kind, image, steps):
+    if kind == 'segment':
+        return pool.submit('segment', [image], room_type='Living Room')
+    return pool.submit('redesign', [image], room_type='Living Room', num_inference_steps=steps)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--threads', default='1,2,4')
+    parser.add_argument('--kind', choices=['segment', 'redesign'], default='segment')
+    parser.add_argument('--jobs', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=10, help='Denoising steps for redesign jobs.')
+    args = parser.parse_args()
+
+    image = cv2.resize(cv2.imread(IMAGE), (512, 512))
+    print(f"{os.cpu_count()} cores, {args.jobs} {args.kind} jobs per run")
+
+    for workers in map(int, args.workers.split(',')):
+        for threads in map(int, args.threads.split(',')):
+            pool = AIWorkerPool(workers=workers, threads_per_worker=threads)
+            try:
+                # Warm up: every worker loads its models and runs once
+                for future in [submit(pool, args.kind, image, args.steps) for _ in range(workers)]:
+                    future.result()
+
+                start = time.perf_counter()
+                futures = [submit(pool, args.kind, image, args.steps) for _ in range(args.jobs)]
+                for future in futures:
+                    future.result()
+                elapsed = time.perf_counter() - start
+            finally:
+                pool.close()
+
+            print(f"workers={workers} threads={threads}: {args.jobs / elapsed:.2f} jobs/s "
+                  f"({elapsed / args.jobs * 1000:.0f} ms/job)")
+
+
+if __name__ == '__main__':
+    main()
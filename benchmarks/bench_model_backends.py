@@ -0,0 +1,138 @@
+"""Latency, peak memory and output equivalence of the segmentation/CLIP inference backends.
+
+Each variant runs in its own process so peak RSS is measured per backend.
+Segmentation is compared to eager with pixel agreement and mean IoU of the
+classes eager predicts; CLIP with embedding cosine and room label agreement.
+
+Export the models first (python model_export.py --backend onnx --quantize), then:
+    python benchmarks/bench_model_backends.py [--variants eager,onnx,onnx:int8,torchscript]
+                                              [--profile quality] [--repeats 5]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+FIXTURES = os.path.join('benchmarks', 'fixtures', 'room_labels.json')
+# Same defaults as ai.ROOM_TYPES / ai.ROOM_PROMPT_TEMPLATE, without their environment overrides
+ROOM_TYPES = ["Living Room", "Bedroom", "Kitchen", "Bathroom", "Dining Room", "Office"]
+ROOM_PROMPT_TEMPLATE = "a photo of a {}"
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_variant(variant, profile, repeats, output_path):
+    import cv2
+    import torch
+    from PIL import Image
+    from transformers import CLIPModel, CLIPProcessor
+
+    from model_export import (CLIP_MODEL_NAME, SegmentationLogits, build_clip_image_encoder,
+                              build_segmentation_model, clip_text_features, load_model,
+                              segmentation_preprocess)
+
+    backend, _, quantized = variant.partition(':')
+    quantized = quantized == 'int8'
+    with open(FIXTURES) as f:
+        image_paths = list(json.load(f))
+
+    # Like ai.segmentation_model, INT8 variants keep segmentation fp32
+    segmentation = load_model(f"segmentation-{profile}", backend, False,
+                              lambda: SegmentationLogits(build_segmentation_model(profile)))
+    image_encoder = load_model("clip-image", backend, quantized, build_clip_image_encoder)
+    clip_processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    rss_loaded = peak_rss_mb()
+
+    segment_ms, encode_ms, masks, embeddings = [], [], [], []
+    with torch.no_grad():
+        for path in image_paths:
+            image = cv2.resize(cv2.imread(path), (512, 512))
+            segment_input = segmentation_preprocess(image).unsqueeze(0)
+            clip_input = clip_processor(images=[Image.open(path).convert("RGB")],
+                                        return_tensors="pt")["pixel_values"]
+            for _ in range(repeats):
+                start = time.perf_counter()
+                logits = segmentation(segment_input)
+                segment_ms.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                features = image_encoder(clip_input)
+                encode_ms.append((time.perf_counter() - start) * 1000)
+            masks.append(logits[0].argmax(0).numpy().astype(np.uint8))
+            embeddings.append(features[0].numpy())
+
+    rss_peak = peak_rss_mb()
+
+    # Label set text embeddings always come from the eager text encoder, as in ai.py
+    del segmentation, image_encoder
+    clip_model = CLIPModel.from_pretrained(CLIP_MODEL_NAME).eval()
+    prompts = [ROOM_PROMPT_TEMPLATE.format(label.lower()) for label in ROOM_TYPES]
+    with torch.no_grad():
+        text = clip_text_features(clip_model, clip_processor(text=prompts, return_tensors="pt", padding=True))
+    text = (text / text.norm(dim=-1, keepdim=True)).numpy()
+
+    np.savez(output_path, masks=np.stack(masks), embeddings=np.stack(embeddings),
+             labels=(np.stack(embeddings) @ text.T).argmax(1),
+             segment_ms=np.median(segment_ms), encode_ms=np.median(encode_ms), rss_loaded=rss_loaded,
+             rss_peak=rss_peak)
+
+
+def mean_iou(reference, candidate):
+    ious = []
+    for cls in np.unique(reference):
+        union = np.logical_or(reference == cls, candidate == cls).sum()
+        ious.append(np.logical_and(reference == cls, candidate == cls).sum() / union)
+    return float(np.mean(ious))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--variants', default='eager,torchscript,onnx,onnx:int8')
+    parser.add_argument('--profile', choices=['quality', 'fast'], default='quality')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_variant(args.run, args.profile, args.repeats, args.output)
+        return
+
+    variants = args.variants.split(',')
+    if variants[0] != 'eager':
+        variants.insert(0, 'eager')
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {}
+        for variant in variants:
+            output = os.path.join(directory, variant.replace(':', '-') + '.npz')
+            subprocess.run([sys.executable, __file__, '--run', variant, '--profile', args.profile,
+                            '--repeats', str(args.repeats), '--output', output], check=True)
+            results[variant] = dict(np.load(output))
+
+    eager = results['eager']
+    print(f"profile={args.profile}")
+    for variant, result in results.items():
+        iou = np.mean([mean_iou(ref, cand) for ref, cand in zip(eager['masks'], result['masks'])])
+        pixels = np.mean(eager['masks'] == result['masks'])
+        cosine = np.mean(np.sum(eager['embeddings'] * result['embeddings'], axis=1))
+        labels = np.mean(eager['labels'] == result['labels'])
+        print(f"{variant:<16} segment {float(result['segment_ms']):7.1f} ms  "
+              f"clip {float(result['encode_ms']):6.1f} ms  rss {float(result['rss_loaded']):5.0f}/{float(result['rss_peak']):5.0f} MB  "
+              f"mIoU {iou:.3f}  pixels {pixels:.3f}  cosine {cosine:.4f}  labels {labels:.2f}")
+
+
+if __name__ == '__main__':
+    main()
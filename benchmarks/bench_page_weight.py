@@ -0,0 +1,84 @@
+"""Bytes transferred and time to first byte per page, before and after the asset pipeline.
+
+"Before" is what the pages cost when every stylesheet was an inline <style>
+block: the HTML plus the unminified CSS on every view, uncompressed. "After"
+is the compressed HTML plus the minified, precompressed bundles on a first
+visit, and the compressed HTML alone on repeat visits (bundles are cached).
+
+Run `flask --app app build-assets` first, then:
+    python benchmarks/bench_page_weight.py [--repeats 20]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from app import app  # noqa: E402
+from assets import load_manifest  # noqa: E402
+from db_setup import Project, User  # noqa: E402
+
+STYLESHEET = re.compile(r'<link rel="stylesheet" href="(/static/[^"]+)"')
+
+
+def fetch(client, url, encoding, repeats):
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return response, timings[len(timings) // 2]
+
+
+def source_css_bytes(url, sources):
+    # Size of the unminified stylesheet that used to be inlined into the page
+    built = url[len('/static/'):]
+    return os.path.getsize(os.path.join('static', sources.get(built, built)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--encoding', default='br, gzip')
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = User.query.first()
+        project = Project.query.first()
+    pages = ['/', '/register', '/home', '/design_your_home', '/portfolio']
+    if project:
+        pages.append(f'/project/{project.id}')
+        pages.append(f'/profile/{project.user_id}')
+
+    sources = {built: source for source, built in load_manifest().items()}
+    client = app.test_client()
+    if user:
+        with client.session_transaction() as session:
+            session['user_id'] = user.id
+            session['username'] = user.username
+
+    print(f"{'page':<20} {'before':>9} {'first':>9} {'repeat':>9} {'ttfb before':>12} {'ttfb after':>11}")
+    for page in pages:
+        app.config['COMPRESS_RESPONSES'] = False
+        plain, ttfb_before = fetch(client, page, None, args.repeats)
+        app.config['COMPRESS_RESPONSES'] = True
+        compressed, ttfb_after = fetch(client, page, args.encoding, args.repeats)
+
+        html = plain.get_data(as_text=True)
+        stylesheets = STYLESHEET.findall(html)
+        before = len(plain.data) + sum(source_css_bytes(url, sources) for url in stylesheets)
+        css_after = sum(len(client.get(url, headers={'Accept-Encoding': args.encoding}).data)
+                        for url in stylesheets)
+        first, repeat = len(compressed.data) + css_after, len(compressed.data)
+
+        print(f"{page:<20} {before:>8}B {first:>8}B {repeat:>8}B {ttfb_before:>10.1f}ms {ttfb_after:>9.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Accuracy and latency of zero-shot room classification against the old pipeline path.
+
+The old path ran the generic image-classification pipeline on CLIP and took the
+top label; it counts as correct when that label contains the expected room type.
+That checkpoint has no trained classification head, so the pipeline answers with
+generic LABEL_n names and is expected to score 0 here.
+
+Usage: python benchmarks/bench_room_classification.py [--repeats 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from transformers import pipeline  # noqa: E402
+
+import ai  # noqa: E402
+
+FIXTURES = os.path.join('benchmarks', 'fixtures', 'room_labels.json')
+
+
+def run(name, classify, fixtures, repeats):
+    correct = 0
+    timings = []
+    for image_path, expected in fixtures.items():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            label = classify(image_path)
+            timings.append((time.perf_counter() - start) * 1000)
+        correct += expected.lower() in label.lower()
+    timings.sort()
+    print(f"{name:<12} accuracy {correct}/{len(fixtures)}  "
+          f"p50 {timings[len(timings) // 2]:.1f} ms  max {timings[-1]:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(FIXTURES) as f:
+        fixtures = json.load(f)
+
+    legacy = pipeline("image-classification", model="openai/clip-vit-base-patch32")
+    legacy(next(iter(fixtures)))
+    ai.classify_room(next(iter(fixtures)))  # encodes the label set once
+
+    run('pipeline', lambda path: legacy(path)[0]['label'], fixtures, args.repeats)
+    run('zero-shot', ai.classify_room, fixtures, args.repeats)
+
+
+if __name__ == '__main__':
+    main()
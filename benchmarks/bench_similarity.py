@@ -0,0 +1,68 @@
+"""Query latency of the similar designs index at realistic sizes, and recall against an exact scan.
+
+With faiss installed, indexes of QUANTIZED_MIN_ROWS or more are searched over
+int8 codes, so recall can drop below 1.
+
+Usage: python benchmarks/bench_similarity.py [--projects 100000] [--queries 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings import EMBEDDING_DIM, EmbeddingIndex  # noqa: E402
+
+
+def random_unit_vectors(rng, count):
+    vectors = rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float16)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--projects', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=6)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        index = EmbeddingIndex(directory=directory)
+
+        start = time.perf_counter()
+        index.add_many(range(1, args.projects + 1), random_unit_vectors(rng, args.projects))
+        print(f"build: {args.projects} vectors in {time.perf_counter() - start:.2f}s, "
+              f"{os.path.getsize(index.matrix_path) / 2**20:.1f} MiB on disk")
+
+        queries = random_unit_vectors(rng, args.queries)
+        index.search(queries[0], k=args.k)  # builds the search copy of the used rows
+
+        timings = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            found.append(index.search(query, k=args.k, exclude=[1]))
+            timings.append((time.perf_counter() - start) * 1000)
+
+        # Exact top-k over the same float16 rows, also without project 1
+        matrix = index.matrix[:args.projects].astype(np.float32)
+        hits = 0
+        for query, matches in zip(queries, found):
+            scores = matrix @ query.astype(np.float32)
+            scores[index.ids[:args.projects] == 1] = -np.inf
+            exact = {int(index.ids[row]) for row in np.argsort(-scores)[:args.k]}
+            hits += len(exact & {project_id for project_id, _ in matches})
+
+        timings = np.array(timings)
+        print(f"search k={args.k} ({type(index._search_rows).__name__.strip('_')}): "
+              f"p50 {np.percentile(timings, 50):.2f} ms, p95 {np.percentile(timings, 95):.2f} ms, "
+              f"max {timings.max():.2f} ms, recall@{args.k} {hits / (args.k * len(queries)):.3f}")
+
+
+if __name__ == '__main__':
+    main()
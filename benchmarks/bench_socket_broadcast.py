@@ -0,0 +1,101 @@
+"""Events/sec and CPU per broadcast for direct emits against coalesced, batched ones.
+
+Builds a standalone Flask-SocketIO server with --rooms chat rooms of
+--listeners test clients each, then sends --events chat messages to random
+rooms. "direct" emits every event to its room as it happens, which is what the
+chat handlers did before batching. "batched" queues events on a RoomBroadcaster
+and flushes them every --events-per-tick events, standing in for the flush
+tick under that much traffic; "batched-msgpack" does the same with msgpack
+payloads. The test clients run the real packet encoding for every emit, so
+CPU per event and per broadcast are comparable across modes.
+
+Usage: python benchmarks/bench_socket_broadcast.py [--rooms 300] [--listeners 2]
+                                                   [--events 20000] [--events-per-tick 1000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, request  # noqa: E402
+from flask_socketio import SocketIO, join_room  # noqa: E402
+
+from chat_broadcast import RoomBroadcaster, RoomPresence, msgpack  # noqa: E402
+
+
+def make_server(rooms, listeners):
+    app = Flask(__name__)
+    socketio = SocketIO(app, async_mode='threading')
+    presence = RoomPresence()
+
+    @socketio.on('join')
+    def handle_join(data):
+        join_room(data['room'])
+        presence.join(request.sid, data['room'])
+
+    clients = []
+    for room in rooms:
+        for _ in range(listeners):
+            client = socketio.test_client(app)
+            client.emit('join', {'room': room})
+            clients.append(client)
+    return socketio, presence, clients
+
+
+def message(i):
+    return {'id': i, 'username': f'user{i % 50}', 'message': f'Message number {i} about the kitchen tiles',
+            'timestamp': datetime(2024, 1, 1).strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def run(mode, socketio, presence, clients, targets, events_per_tick):
+    # A flush interval far beyond the run keeps the background tick out of the measurement
+    broadcaster = RoomBroadcaster(socketio, presence, interval=3600, use_msgpack=mode == 'batched-msgpack')
+    for client in clients:
+        client.get_received()
+
+    broadcasts = 0
+    wall, cpu = time.perf_counter(), time.process_time()
+    for i, room in enumerate(targets, 1):
+        if mode == 'direct':
+            socketio.emit('receive_message', message(i), to=room)
+            broadcasts += 1
+        else:
+            broadcaster.queue(room, 'receive_message', message(i))
+            if i % events_per_tick == 0:
+                broadcasts += broadcaster.flush()
+    if mode != 'direct':
+        broadcasts += broadcaster.flush()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+    packets = sum(len(client.get_received()) for client in clients)
+    print(f"{mode:<16} {len(targets) / wall:>10.0f} {cpu / len(targets) * 1e6:>10.1f}us "
+          f"{broadcasts:>10} {cpu / broadcasts * 1e6:>10.1f}us {packets:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--listeners', type=int, default=2)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--events-per-tick', type=int, default=1000)
+    args = parser.parse_args()
+
+    rooms = [f'{i}_{i + 1}' for i in range(args.rooms)]
+    socketio, presence, clients = make_server(rooms, args.listeners)
+    targets = random.Random(0).choices(rooms, k=args.events)
+
+    print(f"{args.rooms} rooms x {args.listeners} listeners, {args.events} events, "
+          f"{args.events_per_tick} events per tick")
+    print(f"{'mode':<16} {'events/s':>10} {'cpu/event':>12} {'broadcasts':>10} {'cpu/bcast':>12} {'packets':>9}")
+    modes = ['direct', 'batched'] + (['batched-msgpack'] if msgpack is not None else [])
+    for mode in modes:
+        run(mode, socketio, presence, clients, targets, args.events_per_tick)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Time and peak RSS of the tiled full-resolution redesign against a naive full-frame run.
+
+Each mode runs in its own process so ru_maxrss is per mode. The naive run
+inpaints the whole photo in one pass (rounded down to a multiple of 8 pixels),
+which is what tiling avoids; use --max-side to keep it feasible on small hosts.
+
+Usage: python benchmarks/bench_tiled_redesign.py [--image static/uploads/camelli.jpg]
+                                                 [--steps 10] [--max-side 2048]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+def load_image(path, max_side):
+    image = cv2.imread(path)
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def run_mode(mode, image, steps):
+    from PIL import Image
+
+    import ai
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time.perf_counter()
+    if mode == 'tiled':
+        _, _, tiles = ai.redesign_tiled(image, 'Bedroom', num_inference_steps=steps)
+        detail = f"{tiles} tiles inpainted"
+    else:
+        height, width = (side - side % 8 for side in image.shape[:2])
+        image = image[:height, :width]
+        mask, prompt = ai.segment_and_generate_prompt(cv2.resize(image, (512, 512)), 'Bedroom')
+        mask = mask.resize((width, height), Image.NEAREST)
+        ai.inpaint_pipeline()(prompt=prompt, image=Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)),
+                              mask_image=mask, height=height, width=width, num_inference_steps=steps)
+        detail = "one full-frame pass"
+    elapsed = time.perf_counter() - start
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"{mode:<6} {image.shape[1]}x{image.shape[0]}: {elapsed:7.1f} s, peak RSS {rss_peak:6.0f} MB "
+          f"(+{rss_peak - rss_before:.0f} MB over loaded models), {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image', default=os.path.join('static', 'uploads', 'camelli.jpg'))
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--max-side', type=int, default=2048)
+    parser.add_argument('--mode', choices=['tiled', 'naive'], help='Run a single mode in this process.')
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, load_image(args.image, args.max_side), args.steps)
+        return
+
+    for mode in ('tiled', 'naive'):
+        result = subprocess.run([sys.executable, __file__, '--mode', mode, '--image', args.image,
+                                 '--steps', str(args.steps), '--max-side', str(args.max_side)])
+        if result.returncode:
+            print(f"{mode:<6} failed with exit code {result.returncode} (out of memory?)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import threading
+from collections import defaultdict
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; batches fall back to JSON
+    msgpack = None
+
+# How long outbound events wait to be coalesced into one batch per room
+FLUSH_INTERVAL = 0.05
+BATCH_EVENT = 'batch'
+
+
+class RoomPresence:
+    """Connected socket ids per chat room, and the user behind each socket.
+
+    Updated from the connect, join and disconnect handlers so the app can ask
+    whether anyone is listening in a room, or whether a user is online at all,
+    without touching the database.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._rooms = defaultdict(set)
+        self._sid_rooms = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def connect(self, sid, user_id):
+        with self._lock:
+            self._users[sid] = user_id
+
+    def join(self, sid, room):
+        with self._lock:
+            self._rooms[room].add(sid)
+            self._sid_rooms[sid].add(room)
+
+    def leave(self, sid, room):
+        with self._lock:
+            self._discard(sid, room)
+            self._sid_rooms[sid].discard(room)
+
+    def disconnect(self, sid):
+        """Forget a socket; returns the rooms it was in."""
+        with self._lock:
+            self._users.pop(sid, None)
+            rooms = self._sid_rooms.pop(sid, set())
+            for room in rooms:
+                self._discard(sid, room)
+            return rooms
+
+    def _discard(self, sid, room):
+        sids = self._rooms.get(room)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._rooms[room]
+
+    def listeners(self, room):
+        with self._lock:
+            return len(self._rooms.get(room, ()))
+
+    def users_in(self, room):
+        """Ids of the signed-in users with at least one socket in the room."""
+        with self._lock:
+            return {self._users.get(sid) for sid in self._rooms.get(room, ())} - {None}
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._users.values()
+
+
+class RoomBroadcaster:
+    """Coalesces outbound events per room and flushes them as one batch per tick.
+
+    Every queued event is delivered as part of a single ``batch`` event, whose
+    payload is a list of ``[event, data]`` pairs in queue order, either as
+    JSON or as a msgpack-encoded binary attachment. Events for rooms without
+    listeners are dropped; those clients catch up through the resync on join.
+    """
+
+    def __init__(self, socketio, presence, interval=FLUSH_INTERVAL, use_msgpack=False):
+        if use_msgpack and msgpack is None:
+            raise RuntimeError("use_msgpack requires the msgpack package")
+        self.socketio = socketio
+        self.presence = presence
+        self.interval = interval
+        self.use_msgpack = use_msgpack
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def queue(self, room, event, data):
+        """Schedule ``event`` for everyone in ``room``; returns False if nobody is listening."""
+        if not self.presence.listeners(room):
+            return False
+        with self._lock:
+            self._pending.setdefault(room, []).append([event, data])
+            if self._task is None:
+                self._task = self.socketio.start_background_task(self._run)
+        return True
+
+    def flush(self):
+        """Emit every pending batch now; returns the number of batches sent."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for room, events in pending.items():
+            payload = msgpack.packb(events) if self.use_msgpack else events
+            self.socketio.emit(BATCH_EVENT, payload, to=room)
+        return len(pending)
+
+    def _run(self):
+        # Ticks only while there is traffic; the next queue() after a quiet tick starts a new task
+        while True:
+            self.socketio.sleep(self.interval)
+            if self.flush():
+                continue
+            with self._lock:
+                if not self._pending:
+                    self._task = None
+                    return
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict, deque
+
+# Recent messages kept per chat room, and how many rooms are kept in memory at once
+MESSAGES_PER_ROOM = 200
+MAX_ROOMS = 1000
+# Upper bound on a single resync batch served from the database
+MAX_RESYNC_MESSAGES = 500
+
+
+class RecentMessages:
+    """Bounded in-memory ring buffer of recent message payloads per chat room.
+
+    For every buffered room we track ``covers_from``: all messages of the room
+    with an id greater than it are in the buffer. A client that last saw a
+    message at or after that point can be resynced without touching the
+    database. Buffers are per process, which matches the single SocketIO
+    server this app runs.
+    """
+
+    def __init__(self, per_room=MESSAGES_PER_ROOM, max_rooms=MAX_ROOMS):
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _touch(self, room):
+        self._rooms.move_to_end(room)
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+
+    def load(self, room, payloads, last_id):
+        """Seed a room with every payload newer than ``last_id`` (oldest first).
+
+        Does nothing if the room is already buffered, since messages sent while
+        the caller was reading the database may have been appended meanwhile.
+        """
+        with self._lock:
+            if room in self._rooms:
+                return
+            buffer = deque(payloads[-self.per_room:], maxlen=self.per_room)
+            # Only the kept tail is covered when the payloads didn't fit
+            covers_from = last_id if len(payloads) <= self.per_room else buffer[0]['id'] - 1
+            self._rooms[room] = [buffer, covers_from]
+            self._touch(room)
+
+    def append(self, room, payload):
+        """Add a newly sent message, keeping the buffer in id order.
+
+        Send handlers run concurrently, so a message can arrive after one with
+        a higher id that was committed later; it is inserted in place.
+        """
+        message_id = payload['id']
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry is None:
+                # Nothing is known about older messages, so only newer ones are covered
+                entry = self._rooms[room] = [deque(maxlen=self.per_room), message_id - 1]
+            buffer = entry[0]
+            if message_id <= entry[1]:
+                # Older than what the buffer claims to cover
+                return
+            index = len(buffer)
+            while index and buffer[index - 1]['id'] > message_id:
+                index -= 1
+            if index and buffer[index - 1]['id'] == message_id:
+                # Already loaded from the database by a concurrent resync
+                return
+            if len(buffer) == buffer.maxlen:
+                if index == 0:
+                    # It would be evicted right away as the oldest
+                    entry[1] = message_id
+                    return
+                entry[1] = buffer.popleft()['id']
+                index -= 1
+            buffer.insert(index, payload)
+            self._touch(room)
+
+    def since(self, room, last_id):
+        """Payloads after ``last_id``, or None if the buffer can't prove none are missing."""
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry is None or last_id < entry[1]:
+                return None
+            self._touch(room)
+            return [payload for payload in entry[0] if payload['id'] > last_id]
@@ -2,7 +2,7 @@ from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, case, cast, func
 # Create Flask app
 app = Flask(__name__)
 
@@ -21,6 +21,10 @@ IST = timezone(timedelta(hours=5, minutes=30))
 def get_ist_time():
     return datetime.now(IST)
 
+def _average(total, count):
+    """SQL expression for total / count that stays NULL while nothing has been rated"""
+    return case((count > 0, cast(total, db.Float) / count), else_=None)
+
 # Define your models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -28,7 +32,11 @@ class User(db.Model):
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
     bio = db.Column(db.Text, nullable=True)
-    rating = db.Column(db.Float, nullable=True)
+    rating = db.Column(db.Float, nullable=True, index=True)  # Average rating across the user's projects
+    # Cached review aggregates over all the user's projects, kept in step by Review.add_review
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     is_admin = db.Column(db.Boolean, default=False)  # New column for admin role
 
 class Project(db.Model):
@@ -41,6 +49,11 @@ class Project(db.Model):
     user = db.relationship('User', backref=db.backref('projects', lazy=True))
     reviews = db.relationship('Review', backref='project', lazy=True)
     room_type = db.Column(db.String(50), nullable=False)  # Type of room: Bedroom, Kitchen, etc.
+    # Cached review aggregates, kept in step by Review.add_review
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_avg = db.Column(db.Float, nullable=True, index=True)
     def __repr__(self):
         return f'<Project {self.name}>'
 
@@ -50,9 +63,36 @@ class Review(db.Model):
     content = db.Column(db.Text, nullable=False)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    rating = db.Column(db.Integer, nullable=True)  # 1-5 stars, empty for older reviews
     # Relationship to get user details
     user = db.relationship('User', backref='reviews', lazy=True)
 
+    @classmethod
+    def add_review(cls, project, user_id, content, rating=None):
+        """Save a review and bump the cached aggregates of the project and its uploader in one transaction"""
+        review = cls(content=content, project_id=project.id, user_id=user_id, rating=rating)
+        db.session.add(review)
+
+        rated = 1 if rating is not None else 0
+        stars = rating or 0
+        # Computed in SQL from the stored values, so concurrent reviews can't overwrite each other
+        db.session.query(Project).filter(Project.id == project.id).update({
+            Project.review_count: Project.review_count + 1,
+            Project.rating_count: Project.rating_count + rated,
+            Project.rating_sum: Project.rating_sum + stars,
+            Project.rating_avg: _average(Project.rating_sum + stars, Project.rating_count + rated),
+        }, synchronize_session=False)
+        if project.user_id is not None:
+            db.session.query(User).filter(User.id == project.user_id).update({
+                User.review_count: User.review_count + 1,
+                User.rating_count: User.rating_count + rated,
+                User.rating_sum: User.rating_sum + stars,
+                User.rating: _average(User.rating_sum + stars, User.rating_count + rated),
+            }, synchronize_session=False)
+
+        db.session.commit()
+        return review
+
 class ChatRoom(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
@@ -112,14 +152,51 @@ class Message(db.Model):
     @classmethod
     def mark_messages_as_read(cls, chat_room_id, user_id):
         """Mark all unread messages in a room as read for a user"""
-        unread_messages = cls.query.filter_by(
+        # One UPDATE statement, and no commit at all when nothing was unread
+        updated = cls.query.filter_by(
             chat_room_id=chat_room_id,
             read=False
-        ).filter(cls.sender_id != user_id).all()
-        
-        for message in unread_messages:
-            message.read = True
-        db.session.commit()
+        ).filter(cls.sender_id != user_id).update({'read': True}, synchronize_session=False)
+        if updated:
+            db.session.commit()
 
     def __repr__(self):
-        return f'<Message {self.id} from {self.sender_id}>'
\ No newline at end of file
+        return f'<Message {self.id} from {self.sender_id}>'
+
+def _rebuild_aggregates(model, owner_column, avg_attr, batch_size):
+    rated = case((Review.rating.isnot(None), 1), else_=0)
+    last_id = 0
+    while True:
+        ids = [row.id for row in db.session.query(model.id).filter(model.id > last_id)
+               .order_by(model.id).limit(batch_size)]
+        if not ids:
+            break
+
+        totals = db.session.query(
+            owner_column.label('owner_id'),
+            func.count(Review.id).label('reviews'),
+            func.sum(rated).label('ratings'),
+            func.coalesce(func.sum(Review.rating), 0).label('stars'),
+        ).select_from(Review).join(Project, Review.project_id == Project.id) \
+            .filter(owner_column.in_(ids)).group_by(owner_column)
+        totals = {row.owner_id: row for row in totals}
+
+        mappings = []
+        for owner_id in ids:
+            row = totals.get(owner_id)
+            reviews, ratings, stars = (row.reviews, row.ratings, row.stars) if row else (0, 0, 0)
+            mappings.append({
+                'id': owner_id,
+                'review_count': reviews,
+                'rating_count': ratings,
+                'rating_sum': stars,
+                avg_attr: stars / ratings if ratings else None,
+            })
+        db.session.bulk_update_mappings(model, mappings)
+        db.session.commit()
+        last_id = ids[-1]
+
+def rebuild_review_aggregates(batch_size=500):
+    """Recompute the cached review aggregates of every project and uploader from the Review table"""
+    _rebuild_aggregates(Project, Project.id, 'rating_avg', batch_size)
+    _rebuild_aggregates(User, Project.user_id, 'rating', batch_size)
@@ -0,0 +1,305 @@
+import contextlib
+import os
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; the index is then only safe within one process
+    fcntl = None
+
+try:
+    import faiss
+except ImportError:  # faiss is optional; searches then always scan a float32 copy with NumPy
+    faiss = None
+
+# CLIP ViT-B/32 image embeddings are 512-dimensional
+EMBEDDING_DIM = 512
+INDEX_DIR = os.path.join('instance', 'embeddings')
+# With faiss installed, indexes of at least this many rows are searched over int8 codes
+QUANTIZED_MIN_ROWS = 20_000
+# Rows converted to float32 at a time when (re)building the search rows
+BUILD_CHUNK_ROWS = 8192
+
+
+class _ExactRows:
+    """float32 copy of the used rows, scanned with one matrix-vector product."""
+
+    def __init__(self, dim):
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, vectors):
+        # Grow by half again when rows are appended, so inserts stay amortised O(1)
+        end = self.size + len(vectors)
+        if end > len(self.matrix):
+            grown = np.empty((max(end, len(self.matrix) * 3 // 2), self.matrix.shape[1]), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+        self.matrix[self.size:end] = vectors
+        self.size = end
+
+    def update(self, rows, vectors):
+        self.matrix[rows] = vectors
+
+    def top(self, vector, k, excluded):
+        scores = self.matrix[:self.size] @ vector
+        scores[excluded] = -np.inf
+        # argpartition is O(n); only the k winners get fully sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+
+class _QuantizedRows:
+    """int8 copy of the used rows, scanned with faiss' int8 inner-product kernel.
+
+    Rows are scaled so the largest component of the build-time sample maps to
+    127 (later outliers are clipped) and each query to its own largest
+    component, so a score is an exact int8 dot product scaled back to an
+    approximate cosine similarity. A quarter of the memory of the float32 copy.
+    """
+
+    def __init__(self, sample):
+        self.scale = 127 / max(float(np.abs(sample).max()), 1e-6)
+        self.index = faiss.IndexScalarQuantizer(sample.shape[1], faiss.ScalarQuantizer.QT_8bit_direct_signed,
+                                                faiss.METRIC_INNER_PRODUCT)
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def _quantize(self, vectors, scale):
+        return np.clip(np.rint(vectors * scale), -128, 127).astype(np.float32)
+
+    def extend(self, vectors):
+        self.index.add(self._quantize(vectors, self.scale))
+
+    def update(self, rows, vectors):
+        codes = faiss.rev_swig_ptr(self.index.codes.data(), self.index.codes.size())
+        codes.reshape(-1, self.index.code_size)[rows] = self.index.sa_encode(self._quantize(vectors, self.scale))
+
+    def top(self, vector, k, excluded):
+        query_scale = 127 / max(float(np.abs(vector).max()), 1e-6)
+        params = None
+        if len(excluded):
+            selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(excluded))
+            params = faiss.SearchParameters(sel=selector)
+        scores, rows = self.index.search(self._quantize(vector[None], query_scale), k, params=params)
+        found = rows[0] >= 0
+        return rows[0][found], scores[0][found] / (self.scale * query_scale)
+
+
+class EmbeddingIndex:
+    """Project image embeddings kept in a memory-mapped float16 matrix on disk.
+
+    Row ``i`` of ``vectors.npy`` belongs to the project id stored at ``ids[i]``.
+    Rows of deleted projects are marked with id -1 and reused by later inserts.
+    Vectors are L2-normalised, so a dot product is the cosine similarity.
+
+    Several web processes may share one index directory: writes take an
+    exclusive ``flock`` on ``index.lock`` and reload the files first when
+    another process has changed them. ``versions.npy`` records the write that
+    last touched each row, so a reload only refreshes the rows that changed.
+
+    NumPy has no fast float16 matrix-vector product, so searches scan a
+    per-process copy of the used rows: float32 (~2 KB per project), or with
+    faiss installed and at least ``QUANTIZED_MIN_ROWS`` rows, int8 codes
+    (~0.5 KB per project) with approximate scores.
+    """
+
+    def __init__(self, directory=INDEX_DIR, dim=EMBEDDING_DIM, initial_capacity=1024):
+        self.directory = directory
+        self.dim = dim
+        self.initial_capacity = initial_capacity
+        self.matrix_path = os.path.join(directory, 'vectors.npy')
+        self.ids_path = os.path.join(directory, 'ids.npy')
+        self.versions_path = os.path.join(directory, 'versions.npy')
+        self.lock_path = os.path.join(directory, 'index.lock')
+        self._lock = threading.Lock()
+        # Search copy of rows [0, len); built on the first query
+        self._search_rows = None
+        self._load()
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        """Hold the in-process lock and a shared or exclusive lock on the index files."""
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            # Closing the file releases the flock
+            self._reload_if_changed()
+            yield
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load_files()
+
+    def _load_files(self, rows=None):
+        if os.path.exists(self.matrix_path) and os.path.exists(self.ids_path):
+            self.matrix = np.load(self.matrix_path, mmap_mode='r+')
+            self.ids = np.load(self.ids_path)
+            if os.path.exists(self.versions_path):
+                self.versions = np.load(self.versions_path)
+            else:
+                # Indexes written before versions were tracked
+                self.versions = np.zeros(len(self.ids), dtype=np.int64)
+        else:
+            self.matrix = np.lib.format.open_memmap(
+                self.matrix_path, mode='w+', dtype=np.float16,
+                shape=(self.initial_capacity, self.dim))
+            self.ids = np.full(self.initial_capacity, -1, dtype=np.int64)
+            self.versions = np.zeros(self.initial_capacity, dtype=np.int64)
+            self._save_ids()
+
+        # A reload passes the current project id -> row map and patches it itself
+        if rows is None:
+            rows = {int(pid): row for row, pid in enumerate(self.ids) if pid != -1}
+        self._rows = rows
+        # Lowest free row is popped first so the used rows stay packed at the front
+        self._free = list(np.flatnonzero(self.ids == -1)[::-1])
+        # Rows past this point have never been used, so searches can skip them
+        used = np.flatnonzero(self.ids != -1)
+        self._end = int(used[-1]) + 1 if len(used) else 0
+        self._write = int(self.versions.max())
+        self._ids_version = self._file_version()
+
+    def _save_ids(self):
+        # ids.npy goes last: its replacement is what other processes watch for
+        for path, array in ((self.versions_path, self.versions), (self.ids_path, self.ids)):
+            tmp_path = path + '.tmp.npy'
+            np.save(tmp_path, array)
+            os.replace(tmp_path, path)
+        self._ids_version = self._file_version()
+
+    def _file_version(self):
+        # ids.npy is replaced on every write, so its inode changes even within one mtime tick
+        stat = os.stat(self.ids_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload_if_changed(self):
+        # Another process may have written to the index since we loaded it
+        if self._file_version() == self._ids_version:
+            return
+        ids, versions = self.ids, self.versions
+        self._load_files(rows=self._rows)
+
+        # Only the rows another process has written since need their project ids and search copy refreshed
+        changed = np.flatnonzero(self.versions != np.pad(versions, (0, len(self.versions) - len(versions))))
+        for row in changed:
+            old_id = int(ids[row]) if row < len(ids) else -1
+            if old_id != -1 and self._rows.get(old_id) == row:
+                del self._rows[old_id]
+        for row in changed:
+            if self.ids[row] != -1:
+                self._rows[int(self.ids[row])] = int(row)
+        if self._search_rows is not None:
+            changed = changed[changed < len(self._search_rows)]
+            if len(changed):
+                self._search_rows.update(changed, self.matrix[changed].astype(np.float32))
+
+    def _grow(self):
+        capacity = self.matrix.shape[0]
+        tmp_path = self.matrix_path + '.tmp.npy'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16,
+                                          shape=(capacity * 2, self.dim))
+        grown[:capacity] = self.matrix
+        grown.flush()
+        del grown
+        self.matrix = None
+        os.replace(tmp_path, self.matrix_path)
+        self.matrix = np.load(self.matrix_path, mmap_mode='r+')
+
+        self.ids = np.concatenate([self.ids, np.full(capacity, -1, dtype=np.int64)])
+        self.versions = np.concatenate([self.versions, np.zeros(capacity, dtype=np.int64)])
+        self._free = list(range(capacity * 2 - 1, capacity - 1, -1))
+
+    def _put(self, project_id, vector):
+        row = self._rows.get(project_id)
+        if row is None:
+            if not self._free:
+                self._grow()
+            row = self._free.pop()
+            self._rows[project_id] = row
+            self.ids[row] = project_id
+            self._end = max(self._end, row + 1)
+        self._set_row(row, vector)
+
+    def _set_row(self, row, vector):
+        self.matrix[row] = vector
+        self.versions[row] = self._write
+        if self._search_rows is not None and row < len(self._search_rows):
+            self._search_rows.update([row], self.matrix[row:row + 1].astype(np.float32))
+
+    def _ensure_search_rows(self, end):
+        if self._search_rows is None or (faiss is not None and end >= QUANTIZED_MIN_ROWS
+                                         and isinstance(self._search_rows, _ExactRows)):
+            if faiss is not None and end >= QUANTIZED_MIN_ROWS:
+                # The int8 scale comes from an even sample of at most ~2 * QUANTIZED_MIN_ROWS rows
+                step = max(1, end // QUANTIZED_MIN_ROWS)
+                self._search_rows = _QuantizedRows(self.matrix[:end:step].astype(np.float32))
+            else:
+                self._search_rows = _ExactRows(self.dim)
+        for start in range(len(self._search_rows), end, BUILD_CHUNK_ROWS):
+            self._search_rows.extend(self.matrix[start:min(start + BUILD_CHUNK_ROWS, end)].astype(np.float32))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, project_id):
+        return project_id in self._rows
+
+    def add(self, project_id, vector):
+        """Store (or replace) the embedding of a single project."""
+        self.add_many([project_id], [vector])
+
+    def add_many(self, project_ids, vectors):
+        """Store embeddings for several projects and write the index once."""
+        with self._locked(exclusive=True):
+            self._write += 1
+            for project_id, vector in zip(project_ids, vectors):
+                self._put(int(project_id), vector)
+            self.matrix.flush()
+            self._save_ids()
+
+    def remove(self, project_id):
+        with self._locked(exclusive=True):
+            row = self._rows.pop(project_id, None)
+            if row is None:
+                return
+            self._write += 1
+            self.ids[row] = -1
+            self._set_row(row, 0)
+            self._free.append(row)
+            self.matrix.flush()
+            self._save_ids()
+
+    def get(self, project_id):
+        """Return the stored embedding of a project, or None if it is not indexed."""
+        with self._locked(exclusive=False):
+            row = self._rows.get(project_id)
+            if row is None:
+                return None
+            return np.array(self.matrix[row], dtype=np.float32)
+
+    def search(self, vector, k=6, exclude=()):
+        """Return up to ``k`` ``(project_id, score)`` pairs, most similar first."""
+        with self._locked(exclusive=False):
+            end = self._end
+            k = min(k, len(self._rows))
+            if k <= 0:
+                return []
+            self._ensure_search_rows(end)
+
+            # Free rows and excluded projects never match
+            excluded = [self._rows[project_id] for project_id in exclude if project_id in self._rows]
+            excluded = np.concatenate([np.flatnonzero(self.ids[:end] == -1),
+                                       np.array(excluded, dtype=np.int64)])
+            rows, scores = self._search_rows.top(np.asarray(vector, dtype=np.float32), k, excluded)
+            return [(int(self.ids[row]), float(score))
+                    for row, score in zip(rows, scores) if np.isfinite(score)]
@@ -0,0 +1,193 @@
+"""Export the segmentation and CLIP image models for faster inference backends.
+
+    python model_export.py --backend onnx --quantize
+    python model_export.py --backend torchscript --profile fast
+
+ai.py picks the backend at startup from AI_BACKEND (eager, compile,
+torchscript or onnx), AI_PROFILE (quality or fast) and AI_QUANTIZED=1.
+"""
+import argparse
+import os
+
+import torch
+from torch import nn
+from torchvision import models, transforms
+from transformers import CLIPModel
+
+MODEL_DIR = os.environ.get("AI_MODEL_DIR", os.path.join("instance", "models"))
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+BACKENDS = ("eager", "compile", "torchscript", "onnx")
+PROFILES = ("quality", "fast")
+
+# Define image transformations for segmentation
+segmentation_preprocess = transforms.Compose([
+    transforms.ToPILImage(),
+    transforms.Resize((512, 512)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+])
+
+
+# DeepLabV3-ResNet101 for the quality profile, the much lighter MobileNetV3 variant for fast
+def build_segmentation_model(profile="quality"):
+    if profile == "fast":
+        model = models.segmentation.deeplabv3_mobilenet_v3_large(pretrained=True)
+    else:
+        model = models.segmentation.deeplabv3_resnet101(pretrained=True)
+    return model.eval()
+
+
+class SegmentationLogits(nn.Module):
+    """DeepLabV3 returning only the ``out`` logits, so it can be traced and exported."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values)['out']
+
+
+class ClipImageEncoder(nn.Module):
+    """CLIP vision tower plus projection, returning L2-normalised image embeddings."""
+
+    def __init__(self, clip_model):
+        super().__init__()
+        # Only the vision side, so traced and exported files don't carry the text tower
+        self.vision_model = clip_model.vision_model
+        self.visual_projection = clip_model.visual_projection
+
+    def forward(self, pixel_values):
+        # The towers are called directly: get_image_features returns a model output, not a tensor, on transformers 5
+        pooled = self.vision_model(pixel_values=pixel_values)[1]
+        features = self.visual_projection(pooled)
+        return features / features.norm(dim=-1, keepdim=True)
+
+
+def clip_text_features(clip_model, inputs):
+    """Projected (unnormalised) CLIP text embeddings for tokenizer ``inputs``."""
+    pooled = clip_model.text_model(input_ids=inputs["input_ids"], attention_mask=inputs.get("attention_mask"))[1]
+    return clip_model.text_projection(pooled)
+
+
+def build_clip_image_encoder():
+    return ClipImageEncoder(CLIPModel.from_pretrained(CLIP_MODEL_NAME)).eval()
+
+
+def exported_path(name, backend, quantized=False):
+    suffix = ".onnx" if backend == "onnx" else ".pt"
+    return os.path.join(MODEL_DIR, name + ("-int8" if quantized else "") + suffix)
+
+
+def supports_quantization(module):
+    """Whether an INT8 variant of ``module`` would be worth having.
+
+    Only matmuls (nn.Linear) are quantized, on both backends: onnxruntime's dynamically
+    quantized convolutions run several times slower than fp32 on CPU, so DeepLabV3 stays fp32.
+    """
+    return any(isinstance(layer, nn.Linear) for layer in module.modules())
+
+
+def drop_weight_shapes(path):
+    """Remove the shape annotations of weights from an ONNX model, in place.
+
+    torch's dynamo-based exporter writes them, and onnxruntime's quantizer fails on
+    them once it has rewritten the layers (e.g. CLIP's transposed projection Gemm).
+    """
+    import onnx
+
+    model = onnx.load(path, load_external_data=False)
+    weights = {initializer.name for initializer in model.graph.initializer}
+    kept = [info for info in model.graph.value_info if info.name not in weights]
+    del model.graph.value_info[:]
+    model.graph.value_info.extend(kept)
+    onnx.save(model, path)
+
+
+def export_model(module, example, name, backend, quantize=False):
+    """Write ``module`` in the given backend format and return the file path.
+
+    Returns None for an INT8 variant of a model without matmuls (see ``supports_quantization``).
+    """
+    if quantize and not supports_quantization(module):
+        return None
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = exported_path(name, backend, quantize)
+
+    if backend == "torchscript":
+        if quantize:
+            # Dynamic quantization of the Linear layers, i.e. the CLIP vision transformer
+            module = torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            traced = torch.jit.trace(module, example, strict=False)
+        traced.save(path)
+    elif backend == "onnx":
+        fp32_path = exported_path(name, "onnx")
+        torch.onnx.export(module, example, fp32_path, input_names=["input"], output_names=["output"],
+                          dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}}, opset_version=18)
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            drop_weight_shapes(fp32_path)
+            quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8,
+                             op_types_to_quantize=["MatMul", "Gemm"])
+    else:
+        raise ValueError(f"{backend} models are built at runtime and cannot be exported")
+
+    return path
+
+
+def load_model(name, backend, quantized, build, device="cpu"):
+    """Return a callable mapping an input tensor to an output tensor on the chosen backend.
+
+    ``build`` creates the eager module and is only called for the eager and
+    compile backends, so exported models don't keep the eager weights around.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend: {backend}, expected one of {', '.join(BACKENDS)}")
+    if backend == "eager":
+        return build()
+    if backend == "compile":
+        return torch.compile(build())
+
+    path = exported_path(name, backend, quantized)
+    if not os.path.exists(path):
+        if quantized and os.path.exists(exported_path(name, backend)):
+            raise FileNotFoundError(f"{path} not found: {name} has no INT8 variant "
+                                    f"(only models with matmuls are quantized)")
+        command = f"python model_export.py --backend {backend}" + (" --quantize" if quantized else "")
+        raise FileNotFoundError(f"{path} not found, run `{command}` first")
+
+    if backend == "torchscript":
+        return torch.jit.load(path, map_location=device).eval()
+
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def run(pixel_values):
+        return torch.from_numpy(session.run(None, {"input": pixel_values.cpu().numpy()})[0])
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['torchscript', 'onnx'], required=True)
+    parser.add_argument('--profile', choices=PROFILES + ('all',), default='all',
+                        help='Segmentation model profile(s) to export.')
+    parser.add_argument('--quantize', action='store_true',
+                        help='Also write INT8 dynamic-quantized variants of the models with matmuls (CLIP).')
+    args = parser.parse_args()
+
+    profiles = PROFILES if args.profile == 'all' else (args.profile,)
+    exports = [(f"segmentation-{profile}", SegmentationLogits(build_segmentation_model(profile)),
+                torch.randn(1, 3, 512, 512)) for profile in profiles]
+    exports.append(("clip-image", build_clip_image_encoder(), torch.randn(1, 3, 224, 224)))
+
+    for name, module, example in exports:
+        for quantize in (False, True) if args.quantize else (False,):
+            path = export_model(module, example, name, args.backend, quantize)
+            print(path or f"skipped INT8 {name}: it has no matmuls to quantize")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+import ai
+
+# Each session holds the photo, mask and latents (~1 MB) plus ~0.6 MB per cached prompt
+MAX_SESSIONS = 32
+MAX_PROMPTS_PER_SESSION = 4
+MAX_VARIATIONS = 4
+
+
+class RedesignSession:
+    """One uploaded room photo with everything that stays the same between style attempts.
+
+    Segmentation and the VAE encode of the masked photo run once when the
+    session is created (the room type is classified by the caller); text
+    embeddings are kept for the most recent prompts. Rendering a style then
+    only runs the denoising loop.
+    """
+
+    def __init__(self, image, room_type, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.room_type = room_type
+        self.mask, self.prompt = ai.segment_and_generate_prompt(image, room_type)
+        self.image, self.masked_image_latents = ai.encode_redesign_inputs(image, self.mask)
+        self._prompt_embeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _embeds_for(self, prompt):
+        if prompt in self._prompt_embeds:
+            self._prompt_embeds.move_to_end(prompt)
+        else:
+            self._prompt_embeds[prompt] = ai.encode_style_prompt(prompt)
+            while len(self._prompt_embeds) > MAX_PROMPTS_PER_SESSION:
+                self._prompt_embeds.popitem(last=False)
+        return self._prompt_embeds[prompt]
+
+    def render(self, prompt=None, num_variations=1, num_inference_steps=50):
+        """Return ``num_variations`` redesigned PIL images for the prompt (default: the room type prompt)."""
+        prompt = prompt or self.prompt
+        with self._lock:
+            prompt_embeds, negative_prompt_embeds = self._embeds_for(prompt)
+            return ai.redesign_from_cache(self.image, self.mask, self.masked_image_latents,
+                                          prompt_embeds, negative_prompt_embeds,
+                                          num_images=num_variations, num_inference_steps=num_inference_steps)
+
+
+class RedesignSessionStore:
+    """Most recently used redesign sessions, evicting the oldest beyond ``max_sessions``."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, image, room_type, filename):
+        redesign = RedesignSession(image, room_type, filename)
+        with self._lock:
+            self._sessions[redesign.id] = redesign
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return redesign
+
+    def get(self, session_id):
+        with self._lock:
+            redesign = self._sessions.get(session_id)
+            if redesign is not None:
+                self._sessions.move_to_end(session_id)
+            return redesign
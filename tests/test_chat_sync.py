@@ -0,0 +1,69 @@
+from chat_sync import RecentMessages
+
+
+def payloads(*ids):
+    return [{'id': i} for i in ids]
+
+
+def test_empty_load_only_covers_after_last_id():
+    # After a restart an up-to-date client seeds an empty room; older gaps must still go to the database
+    recent = RecentMessages()
+    recent.load('1_2', [], 45)
+    assert recent.since('1_2', 40) is None
+    assert recent.since('1_2', 45) == []
+
+
+def test_load_covers_from_last_id():
+    recent = RecentMessages()
+    recent.load('1_2', payloads(41, 43), 40)
+    assert recent.since('1_2', 40) == payloads(41, 43)
+    assert recent.since('1_2', 39) is None
+
+
+def test_truncated_load_covers_kept_tail_only():
+    recent = RecentMessages(per_room=2)
+    recent.load('1_2', payloads(1, 2, 3), 0)
+    assert recent.since('1_2', 0) is None
+    assert recent.since('1_2', 1) == payloads(2, 3)
+
+
+def test_append_after_load():
+    recent = RecentMessages(per_room=2)
+    recent.load('1_2', payloads(5), 4)
+    recent.append('1_2', {'id': 5})
+    recent.append('1_2', {'id': 6})
+    assert recent.since('1_2', 4) == payloads(5, 6)
+    recent.append('1_2', {'id': 7})
+    assert recent.since('1_2', 4) is None
+    assert recent.since('1_2', 5) == payloads(6, 7)
+
+
+def test_load_keeps_messages_appended_meanwhile():
+    recent = RecentMessages()
+    recent.append('1_2', {'id': 46})
+    recent.load('1_2', payloads(44, 45), 43)
+    assert recent.since('1_2', 45) == payloads(46)
+
+
+def test_out_of_order_append_is_kept():
+    # Two send handlers commit 44 then 45, but 45 reaches the buffer first
+    recent = RecentMessages()
+    recent.load('1_2', [], 43)
+    recent.append('1_2', {'id': 45})
+    recent.append('1_2', {'id': 44})
+    assert recent.since('1_2', 43) == payloads(44, 45)
+    recent.append('1_2', {'id': 44})
+    assert recent.since('1_2', 43) == payloads(44, 45)
+
+
+def test_out_of_order_append_into_full_buffer():
+    recent = RecentMessages(per_room=2)
+    recent.load('1_2', [], 40)
+    recent.append('1_2', {'id': 42})
+    recent.append('1_2', {'id': 43})
+    recent.append('1_2', {'id': 41})
+    # 41 is older than everything kept, so the buffer no longer covers from 40
+    assert recent.since('1_2', 40) is None
+    assert recent.since('1_2', 41) == payloads(42, 43)
+    recent.append('1_2', {'id': 44})
+    assert recent.since('1_2', 42) == payloads(43, 44)
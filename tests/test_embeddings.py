@@ -0,0 +1,100 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import EmbeddingIndex
+
+
+def unit_vectors(count, seed=0, dim=8):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def add_rows(directory, first_id, count):
+    index = EmbeddingIndex(directory=directory, dim=8, initial_capacity=4)
+    for project_id, vector in zip(range(first_id, first_id + count), unit_vectors(count, seed=first_id)):
+        index.add(project_id, vector)
+
+
+@pytest.mark.skipif(embeddings.fcntl is None, reason="the index is only process-safe with flock")
+def test_processes_adding_to_one_directory(tmp_path):
+    # Each process grows the matrix several times; before flock, rows written by the others were lost
+    workers = [multiprocessing.Process(target=add_rows, args=(str(tmp_path), first_id, 50))
+               for first_id in (1000, 2000, 3000, 4000)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    index = EmbeddingIndex(directory=str(tmp_path), dim=8)
+    assert len(index) == 200
+    for first_id in (1000, 2000, 3000, 4000):
+        stored = np.array([index.get(project_id) for project_id in range(first_id, first_id + 50)])
+        np.testing.assert_allclose(stored, unit_vectors(50, seed=first_id), atol=1e-3)
+
+
+def test_remove_frees_the_row_for_reuse(tmp_path):
+    index = EmbeddingIndex(directory=str(tmp_path), dim=8, initial_capacity=4)
+    vectors = unit_vectors(4)
+    index.add_many([1, 2, 3, 4], vectors)
+    index.remove(2)
+    index.remove(3)
+    assert 2 not in index
+    assert index.get(2) is None
+
+    index.add(5, vectors[1])
+    assert index.matrix.shape[0] == 4
+    assert index.ids[index._rows[5]] == 5
+    assert index.search(vectors[1], k=1)[0][0] == 5
+    assert 3 not in [project_id for project_id, _ in index.search(vectors[2], k=3)]
+
+
+def test_grow_keeps_rows(tmp_path):
+    index = EmbeddingIndex(directory=str(tmp_path), dim=8, initial_capacity=2)
+    vectors = unit_vectors(9)
+    index.add_many(range(1, 10), vectors)
+    assert index.matrix.shape[0] == 16
+    assert len(EmbeddingIndex(directory=str(tmp_path), dim=8)) == 9
+    for project_id, vector in zip(range(1, 10), vectors):
+        assert index.search(vector, k=1)[0][0] == project_id
+
+
+def test_search_excludes_projects(tmp_path):
+    index = EmbeddingIndex(directory=str(tmp_path), dim=8)
+    vectors = unit_vectors(3)
+    index.add_many([1, 2, 3], vectors)
+    assert index.search(vectors[0], k=1, exclude=[1])[0][0] != 1
+    assert len(index.search(vectors[0], k=6)) == 3
+
+
+def test_other_process_writes_patch_the_search_rows(tmp_path):
+    reader = EmbeddingIndex(directory=str(tmp_path), dim=8)
+    writer = EmbeddingIndex(directory=str(tmp_path), dim=8)
+    vectors = unit_vectors(4)
+    writer.add_many([1, 2, 3], vectors[:3])
+    assert reader.search(vectors[0], k=1)[0][0] == 1
+    search_rows = reader._search_rows
+
+    # Replacing a vector and removing a project elsewhere must not rebuild the reader's copy
+    writer.add(1, vectors[3])
+    writer.remove(2)
+    assert reader.search(vectors[3], k=1)[0][0] == 1
+    assert 2 not in [project_id for project_id, _ in reader.search(vectors[1], k=3)]
+    assert reader._search_rows is search_rows
+
+
+@pytest.mark.skipif(embeddings.faiss is None, reason="faiss is not installed")
+def test_quantized_search_matches_exact(tmp_path, monkeypatch):
+    monkeypatch.setattr(embeddings, 'QUANTIZED_MIN_ROWS', 100)
+    index = EmbeddingIndex(directory=str(tmp_path), dim=8)
+    vectors = unit_vectors(300)
+    index.add_many(range(300), vectors)
+    assert index.search(vectors[7], k=1)[0][0] == 7
+    assert isinstance(index._search_rows, embeddings._QuantizedRows)
+
+    index.add(7, vectors[8])
+    index.remove(8)
+    assert index.search(vectors[8], k=1)[0][0] == 7
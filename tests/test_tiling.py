@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+cv2 = pytest.importorskip('cv2')
+for module in ('torch', 'torchvision', 'transformers', 'diffusers'):
+    pytest.importorskip(module)
+
+import ai  # noqa: E402
+
+RED = (0, 0, 255)
+
+
+@pytest.mark.parametrize('length', [512, 513, 961, 1500, 4000])
+def test_tile_starts_cover_the_side_with_overlap(length):
+    starts = ai._tile_starts(length, 512, 64)
+    assert starts[0] == 0
+    assert starts[-1] + 512 == length
+    assert all(512 - (b - a) >= 64 for a, b in zip(starts, starts[1:]))
+
+
+def test_tile_starts_spread_evenly():
+    assert ai._tile_starts(300, 512, 64) == [0]
+    assert ai._tile_starts(961, 512, 64) == [0, 224, 449]
+
+
+@pytest.fixture
+def stub_models(monkeypatch):
+    """A segmenter masking a box in the middle third and an inpainter painting tiles red."""
+    tile_masks = []
+
+    def segment(image, room_type):
+        mask = np.zeros((512, 512), dtype=np.uint8)
+        mask[171:341, 171:341] = 255
+        return Image.fromarray(mask), "prompt"
+
+    def redesign(tile, mask, prompt, num_inference_steps):
+        tile_masks.append(np.asarray(mask) > 0)
+        return Image.new('RGB', (tile.shape[1], tile.shape[0]), (255, 0, 0))
+
+    monkeypatch.setattr(ai, 'segment_and_generate_prompt', segment)
+    monkeypatch.setattr(ai, 'redesign_image', redesign)
+    return tile_masks
+
+
+@pytest.mark.parametrize('height, width', [(1500, 2000), (513, 1025), (300, 400)])
+def test_every_masked_pixel_is_inpainted_once(stub_models, height, width):
+    image = np.full((height, width, 3), 80, dtype=np.uint8)
+    output, prompt, inpainted = ai.redesign_tiled(image, 'Bedroom')
+
+    full_height, full_width = max(height, 512), max(width, 512)
+    mask_low = np.asarray(ai.segment_and_generate_prompt(None, None)[0])
+    mask = cv2.resize(mask_low, (full_width, full_height), interpolation=cv2.INTER_NEAREST) > 0
+
+    assert prompt == "prompt"
+    assert inpainted == len(stub_models)
+    assert sum(tile_mask.sum() for tile_mask in stub_models) == mask.sum()
+    mask = mask[:height, :width]
+    assert (output[mask] == RED).all()
+
+    # Away from the mask and its soft edge (the dilation plus the blur's tail) the photo is untouched
+    reach = 5 * (ai.TILE_OVERLAP // 8)
+    far = ~cv2.dilate(mask.astype(np.uint8), np.ones((2 * reach + 1, 2 * reach + 1), np.uint8)).astype(bool)
+    assert (output[far] == 80).all()
+
+
+def test_tiles_without_mask_are_skipped(stub_models):
+    ai.redesign_tiled(np.full((1500, 2000, 3), 80, dtype=np.uint8), 'Bedroom')
+    tiles = len(ai._tile_starts(1500, 512, 64)) * len(ai._tile_starts(2000, 512, 64))
+    assert 0 < len(stub_models) < tiles
+
+
+def test_blending_rounds(stub_models):
+    # Compositing red over red must give red back, not 254 where the soft edge blends
+    image = np.zeros((1500, 2000, 3), dtype=np.uint8)
+    image[:] = RED
+    output, _, _ = ai.redesign_tiled(image, 'Bedroom')
+    assert (output == image).all()